@@ -0,0 +1,80 @@
+"""Scaling benchmark for the scheduling engine on synthetic institutions.
+
+Run from the repository root (no database needed):
+
+    python -m benchmarks.bench_scheduler
+    python -m benchmarks.bench_scheduler --sizes 10 200 --scarcity tight --json results.json
+
+For every (size, scarcity) pair it reports the best wall time over
+`--repeat` runs, the peak Python memory of one run (tracemalloc) and the
+share of classes that were placed.
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+
+import engine
+from benchmarks import synthetic
+
+DEFAULT_SIZES = [10, 50, 200, 500, 2000]
+
+
+def run_case(num_batches, scarcity, mode, repeat, seed):
+    problem = synthetic.generate_institution(num_batches, scarcity, seed=seed)
+    batch_ids = synthetic.batch_ids(problem)
+
+    timings = []
+    for attempt in range(repeat):
+        start = time.perf_counter()
+        result = engine.schedule(problem, batch_ids, mode=mode, rng=random.Random(seed + attempt))
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    engine.schedule(problem, batch_ids, mode=mode, rng=random.Random(seed))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'batches': num_batches,
+        'scarcity': scarcity,
+        'mode': mode,
+        'teachers': len(problem['teachers']),
+        'classes': result['total'],
+        'placed': result['placed'],
+        'placement_rate': result['placed'] / result['total'] if result['total'] else 1.0,
+        'wall_seconds': min(timings),
+        'peak_memory_bytes': peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--scarcity', nargs='+', default=list(synthetic.SCARCITY_LEVELS),
+                        choices=list(synthetic.SCARCITY_LEVELS))
+    parser.add_argument('--mode', nargs='+', default=['search'], choices=engine.MODES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'batches':>8} {'scarcity':<8} {'mode':<8} {'teachers':>8} {'classes':>8} {'placed %':>9} {'wall ms':>10} {'peak MiB':>9}")
+    for num_batches in args.sizes:
+        for scarcity in args.scarcity:
+            for mode in args.mode:
+                row = run_case(num_batches, scarcity, mode, args.repeat, args.seed)
+                results.append(row)
+                print(f"{row['batches']:>8} {row['scarcity']:<8} {row['mode']:<8} {row['teachers']:>8} {row['classes']:>8} "
+                      f"{row['placement_rate'] * 100:>8.1f}% {row['wall_seconds'] * 1000:>10.1f} "
+                      f"{row['peak_memory_bytes'] / 2 ** 20:>9.2f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
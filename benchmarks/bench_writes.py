@@ -0,0 +1,49 @@
+"""Compares the scheduler's timetable write paths against a live database.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_writes --rows 5000 --repeat 3
+
+Rows go into a temporary copy of `timetable` inside a transaction that is
+rolled back, so the real timetable is never touched.
+"""
+import argparse
+import random
+import time
+
+import db
+import scheduler
+from engine import SLOTS
+
+def _synthetic_rows(count):
+    rows = []
+    for i in range(count):
+        day, period = SLOTS[i % len(SLOTS)]
+        rows.append((i // len(SLOTS) + 1, random.randint(1, 50), random.randint(1, 200), day, period))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--methods', nargs='+', default=['rows', 'values', 'copy'],
+                        choices=sorted(scheduler.WRITERS))
+    args = parser.parse_args()
+
+    rows = _synthetic_rows(args.rows)
+    with db.connection() as conn, conn.cursor() as cur:
+        # Never committed: the temp table and its rows vanish on return to the pool.
+        cur.execute("CREATE TEMP TABLE timetable_bench (LIKE timetable INCLUDING DEFAULTS) ON COMMIT DROP;")
+        print(f"{'method':<8} {'best ms':>10} {'rows/s':>12}")
+        for method in args.methods:
+            timings = []
+            for _ in range(args.repeat):
+                cur.execute("TRUNCATE timetable_bench;")
+                start = time.perf_counter()
+                scheduler.write_timetable_rows(cur, rows, method=method, table='timetable_bench')
+                timings.append(time.perf_counter() - start)
+            best = min(timings)
+            print(f"{method:<8} {best * 1000:>10.1f} {args.rows / best:>12.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+"""Load test of a running app: throughput and latency percentiles per route.
+
+Start the app the way it is deployed, e.g. one gunicorn worker, against a
+scratch database, then from the repository root:
+
+    gunicorn -w 1 --threads 8 app:app
+    python -m benchmarks.loadtest --seed-batches 200 --concurrency 32 --duration 60 --json before.json
+    python -m benchmarks.loadtest --concurrency 32 --duration 60 --json after.json --compare before.json
+
+`--seed-batches` REPLACES every teacher, subject, batch and timetable row in
+DATABASE_URL with a synthetic institution (benchmarks/synthetic.py) and
+schedules it, so point DATABASE_URL at a scratch database. It also creates
+the `--username` admin account, or resets its password. Without it, the
+data already there is used. Either way the run stops early if that account
+cannot log in, rather than timing the admin routes' 403s.
+
+Each of `--concurrency` clients loops for `--duration` seconds, choosing a
+request by the `--mix` weights: mostly timetable reads, occasionally an
+admin re-saving a slot it has read (update_slot) or queueing a scheduler
+run. Latencies are recorded per route and status after `--warmup` seconds.
+"""
+import argparse
+import http.cookiejar
+import json
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import psycopg2.extras
+
+import db
+import migrations
+import scheduler
+from benchmarks import synthetic
+
+DEFAULT_MIX = {
+    'get_timetable': 60,
+    'timetable': 25,
+    'home': 10,
+    'update_slot': 4,
+    'run_scheduler_batch': 0.8,
+    'run_scheduler': 0.2,
+}
+PERCENTILES = (50, 95, 99)
+
+
+# --- SEEDING ---
+_SEED_TABLES = {
+    'teachers': ['teacher_id', 'name', 'subject_specialization', 'email', 'max_classes_per_week'],
+    'subjects': ['subject_id', 'subject_name', 'short_code', 'classes_per_week', 'max_per_day'],
+    'batches': ['batch_id', 'batch_name', 'department', 'level'],
+    'teacher_subjects': ['teacher_id', 'subject_id'],
+    'batch_subjects': ['batch_id', 'subject_id', 'classes_per_week'],
+}
+_SERIAL_KEYS = {'teachers': 'teacher_id', 'subjects': 'subject_id', 'batches': 'batch_id'}
+
+
+def seed_database(num_batches, scarcity, seed, credentials):
+    """Replaces the institution in the database with a synthetic one and schedules it.
+
+    The (username, password) admin account is created, or its password reset.
+    """
+    problem = synthetic.generate_institution(num_batches, scarcity, seed=seed)
+    migrations.ensure_migrated()
+    with db.connection() as conn, conn.cursor() as cur:
+        username, password = credentials
+        cur.execute("UPDATE admin SET password = %s WHERE username = %s;", (password, username))
+        if not cur.rowcount:
+            cur.execute("INSERT INTO admin (username, password) VALUES (%s, %s);", (username, password))
+        cur.execute("TRUNCATE timetable, batch_subjects, teacher_subjects, batches, subjects, teachers "
+                    "RESTART IDENTITY CASCADE;")
+        for table, columns in _SEED_TABLES.items():
+            psycopg2.extras.execute_values(
+                cur, f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s",
+                [tuple(row[column] for column in columns) for row in problem[table]], page_size=1000
+            )
+        for table, key in _SERIAL_KEYS.items():
+            cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', '{key}'), (SELECT max({key}) FROM {table}));")
+        conn.commit()
+    summary = scheduler.schedule_all_classes(seed=seed)
+    print(f"Seeded {num_batches} batches, {len(problem['teachers'])} teachers; "
+          f"placed {summary['placed']}/{summary['total']} classes.")
+
+
+# --- CLIENT ---
+ADMIN_ROUTES = ('update_slot', 'run_scheduler_batch', 'run_scheduler')
+
+
+class LoginFailed(Exception):
+    """Raised when the admin credentials are rejected."""
+
+
+class Client:
+    """One simulated user: its own cookie jar (admin session) and the timetables it has read."""
+
+    def __init__(self, base_url, batch_ids, rng, credentials, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.batch_ids = batch_ids
+        self.rng = rng
+        self.credentials = credentials
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.logged_in = False
+        self.seen = {}  # batch_id -> filled cells of its last read timetable
+
+    def _send(self, path, data=None, json_body=None):
+        """Returns (status, body bytes); HTTP error statuses are returned, not raised."""
+        headers = {}
+        if json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            data = urllib.parse.urlencode(data).encode()
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers)
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def _login(self):
+        """Logs in once; raises LoginFailed unless /login redirects to the admin page."""
+        if self.logged_in:
+            return
+        data = urllib.parse.urlencode({'username': self.credentials[0], 'password': self.credentials[1]}).encode()
+        with self.opener.open(urllib.request.Request(self.base_url + '/login', data=data),
+                              timeout=self.timeout) as response:
+            landed_on = urllib.parse.urlparse(response.geturl()).path
+        if landed_on != '/admin':
+            raise LoginFailed(f"Logging in as {self.credentials[0]!r} failed (ended on {landed_on}).")
+        self.logged_in = True
+
+    def _remember(self, batch_id, body):
+        try:
+            self.seen[batch_id] = [cell for cell in json.loads(body) if cell.get('teacher_id')]
+        except ValueError:
+            pass
+
+    def home(self):
+        return self._send('/')[0]
+
+    def get_timetable(self):
+        batch_id = self.rng.choice(self.batch_ids)
+        status, body = self._send('/get_timetable', {'batch_id': batch_id})
+        self._remember(batch_id, body)
+        return status
+
+    def timetable(self):
+        batch_id = self.rng.choice(self.batch_ids)
+        status, body = self._send(f'/timetable/{batch_id}')
+        self._remember(batch_id, body)
+        return status
+
+    def update_slot(self):
+        """Re-saves a class this client has seen, so the edit is valid unless the timetable moved on.
+
+        Returns None, and is not counted, while the client has seen no class.
+        """
+        self._login()
+        batch_ids = [batch_id for batch_id, cells in self.seen.items() if cells]
+        if not batch_ids:
+            return None
+        batch_id = self.rng.choice(batch_ids)
+        cell = self.rng.choice(self.seen[batch_id])
+        return self._send('/admin/update-slot', json_body={
+            'batch_id': batch_id, 'day': cell['day_of_week'], 'period': cell['period'],
+            'subject_id': cell['subject_id'], 'teacher_id': cell['teacher_id'],
+        })[0]
+
+    def run_scheduler_batch(self):
+        self._login()
+        return self._send('/admin/run-scheduler-batch', {'batch_id': self.rng.choice(self.batch_ids)})[0]
+
+    def run_scheduler(self):
+        self._login()
+        return self._send('/run-scheduler', {})[0]
+
+
+# --- RUNNER ---
+def _percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list."""
+    index = max(0, -(-len(sorted_values) * pct // 100) - 1)
+    return sorted_values[int(index)]
+
+
+def run(base_url, batch_ids, mix, concurrency, duration, warmup, credentials, timeout, seed):
+    """Drives the app for warmup + duration seconds; returns {route: {'latencies': [...], 'statuses': {...}}}."""
+    routes, weights = list(mix), list(mix.values())
+    results = {route: {'latencies': [], 'statuses': {}} for route in routes}
+    lock = threading.Lock()
+    started = time.monotonic()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        client = Client(base_url, batch_ids, rng, credentials, timeout)
+        try:
+            client.get_timetable()  # Something for update_slot to re-save.
+        except OSError:
+            pass
+        while True:
+            route = rng.choices(routes, weights)[0]
+            sent = time.monotonic()
+            if sent >= stop_at:
+                return
+            try:
+                status = getattr(client, route)()
+            except (OSError, LoginFailed) as e:  # Refused, reset, timed out or logged out.
+                status = type(e).__name__
+            finished = time.monotonic()
+            # Requests still running at stop_at count too, or the slowest ones would be left out.
+            if status is not None and sent >= measure_from:
+                status = str(status)
+                with lock:
+                    results[route]['latencies'].append(finished - sent)
+                    statuses = results[route]['statuses']
+                    statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def summarize(results, duration):
+    routes = {}
+    for route, data in results.items():
+        latencies = sorted(data['latencies'])
+        if not latencies:
+            continue
+        routes[route] = {
+            'requests': len(latencies),
+            'throughput_rps': len(latencies) / duration,
+            **{f'p{pct}_ms': _percentile(latencies, pct) * 1000 for pct in PERCENTILES},
+            'max_ms': latencies[-1] * 1000,
+            'statuses': data['statuses'],
+        }
+    total = sum(route['requests'] for route in routes.values())
+    return {'requests': total, 'throughput_rps': total / duration, 'routes': routes}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_report(report, baseline=None):
+    print(f"{'route':<20} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}  statuses")
+    for route, row in sorted(report['routes'].items()):
+        line = (f"{route:<20} {row['requests']:>9} {row['throughput_rps']:>8.1f} {row['p50_ms']:>8.1f} "
+                f"{row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['max_ms']:>8.1f}  "
+                f"{' '.join(f'{status}:{count}' for status, count in sorted(row['statuses'].items()))}")
+        print(line)
+        old = (baseline or {}).get('routes', {}).get(route)
+        if old:
+            deltas = ' '.join(f"{key} {(row[key] - old[key]) / old[key] * 100:+.0f}%"
+                              for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms') if old[key])
+            print(f"{'':<20} vs {baseline.get('commit') or 'baseline'}: {deltas}")
+    print(f"{'total':<20} {report['requests']:>9} {report['throughput_rps']:>8.1f}")
+
+
+def _parse_mix(entries):
+    mix = dict(DEFAULT_MIX)
+    for entry in entries or ():
+        route, _, weight = entry.partition('=')
+        if route not in DEFAULT_MIX:
+            raise SystemExit(f"Unknown route in --mix: {route} (choose from {', '.join(DEFAULT_MIX)})")
+        mix[route] = float(weight)
+    return {route: weight for route, weight in mix.items() if weight > 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help="Base URL of the running app.")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30, help="Measured seconds, after the warmup.")
+    parser.add_argument('--warmup', type=float, default=5)
+    parser.add_argument('--mix', nargs='+', metavar='ROUTE=WEIGHT',
+                        help=f"Override request weights (defaults: {DEFAULT_MIX}); 0 disables a route.")
+    parser.add_argument('--seed-batches', type=int, help="Replace the database with this many synthetic batches first.")
+    parser.add_argument('--scarcity', default='tight', choices=list(synthetic.SCARCITY_LEVELS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--timeout', type=float, default=30, help="Per-request timeout in seconds.")
+    parser.add_argument('--json', help="Also write the report to this file.")
+    parser.add_argument('--compare', help="A report written by --json to print changes against.")
+    args = parser.parse_args()
+
+    mix = _parse_mix(args.mix)
+    credentials = (args.username, args.password)
+    if args.seed_batches:
+        seed_database(args.seed_batches, args.scarcity, args.seed, credentials)
+    with db.connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT batch_id FROM batches ORDER BY batch_id;")
+        batch_ids = [row[0] for row in cur.fetchall()]
+    if not batch_ids:
+        raise SystemExit("No batches in the database; use --seed-batches.")
+
+    try:
+        urllib.request.urlopen(args.url, timeout=args.timeout).close()
+    except (OSError, urllib.error.HTTPError) as e:
+        raise SystemExit(f"The app is not reachable at {args.url}: {e}")
+    if any(route in ADMIN_ROUTES for route in mix):
+        try:
+            Client(args.url, batch_ids, random.Random(), credentials, args.timeout)._login()
+        except (LoginFailed, OSError) as e:
+            raise SystemExit(f"{e} Pass --username/--password, use --seed-batches to create the account, "
+                             f"or drop the admin routes with --mix.")
+
+    print(f"{args.concurrency} clients against {args.url} for {args.duration:g}s (+{args.warmup:g}s warmup), "
+          f"{len(batch_ids)} batches")
+    results = run(args.url, batch_ids, mix, args.concurrency, args.duration, args.warmup,
+                  credentials, args.timeout, args.seed)
+    report = {
+        'commit': _git_commit(),
+        'url': args.url,
+        'concurrency': args.concurrency,
+        'duration_seconds': args.duration,
+        'batches': len(batch_ids),
+        'mix': mix,
+        **summarize(results, args.duration),
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    _print_report(report, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Synthetic institutions for exercising the scheduling engine without a database.
+
+`generate_institution` returns a problem dict in the shape `engine.schedule`
+expects (see engine.py). Batches are grouped into departments of
+BATCHES_PER_DEPARTMENT, each with its own subject pool and teaching staff,
+plus a few teachers shared across departments, as in a real college.
+"""
+import math
+import random
+
+import engine
+
+BATCHES_PER_DEPARTMENT = 10
+SUBJECTS_PER_DEPARTMENT = 8
+SUBJECTS_PER_BATCH = 5
+CLASSES_PER_SUBJECT = (3, 4)
+TEACHER_MAX_CLASSES = 16
+# Share of each department's teachers that are also qualified for a subject
+# of a neighbouring department.
+CROSS_DEPARTMENT_SHARE = 0.1
+
+# Teaching capacity relative to the department's demand.
+SCARCITY_LEVELS = {'ample': 1.5, 'tight': 1.1, 'scarce': 0.9}
+
+
+def generate_institution(num_batches, scarcity='tight', seed=0):
+    """Builds a problem with `num_batches` batches and staffing set by `scarcity`."""
+    rng = random.Random(seed)
+    staffing = SCARCITY_LEVELS[scarcity]
+    subjects, teachers, teacher_subjects, batches, batch_subjects = [], [], [], [], []
+    num_departments = math.ceil(num_batches / BATCHES_PER_DEPARTMENT)
+    department_subjects = []
+
+    for dept in range(num_departments):
+        dept_subject_ids = []
+        for _ in range(SUBJECTS_PER_DEPARTMENT):
+            subject_id = len(subjects) + 1
+            subjects.append({
+                'subject_id': subject_id,
+                'subject_name': f'D{dept}-S{subject_id}',
+                'short_code': f'S{subject_id}',
+                'classes_per_week': CLASSES_PER_SUBJECT[1],
+                'max_per_day': 2,
+            })
+            dept_subject_ids.append(subject_id)
+        department_subjects.append(dept_subject_ids)
+
+    for dept in range(num_departments):
+        dept_batches = range(dept * BATCHES_PER_DEPARTMENT, min(num_batches, (dept + 1) * BATCHES_PER_DEPARTMENT))
+        demand = {subject_id: 0 for subject_id in department_subjects[dept]}
+        for index in dept_batches:
+            batch_id = index + 1
+            batches.append({'batch_id': batch_id, 'batch_name': f'B{batch_id}',
+                            'department': f'Dept {dept}', 'level': 'UG'})
+            for subject_id in rng.sample(department_subjects[dept], SUBJECTS_PER_BATCH):
+                classes = rng.randint(*CLASSES_PER_SUBJECT)
+                batch_subjects.append({'batch_id': batch_id, 'subject_id': subject_id, 'classes_per_week': classes})
+                demand[subject_id] += classes
+
+        for subject_id, classes in demand.items():
+            if not classes:
+                continue
+            for _ in range(max(1, round(classes * staffing / TEACHER_MAX_CLASSES))):
+                teacher_id = len(teachers) + 1
+                teachers.append({
+                    'teacher_id': teacher_id,
+                    'name': f'T{teacher_id}',
+                    'subject_specialization': f'S{subject_id}',
+                    'email': f't{teacher_id}@example.edu',
+                    'max_classes_per_week': TEACHER_MAX_CLASSES,
+                })
+                teacher_subjects.append({'teacher_id': teacher_id, 'subject_id': subject_id})
+                if num_departments > 1 and rng.random() < CROSS_DEPARTMENT_SHARE:
+                    other = department_subjects[(dept + 1) % num_departments]
+                    teacher_subjects.append({'teacher_id': teacher_id, 'subject_id': rng.choice(other)})
+
+    return {
+        'subjects': subjects,
+        'teachers': teachers,
+        'teacher_subjects': teacher_subjects,
+        'batches': batches,
+        'batch_subjects': batch_subjects,
+        'commitments': [],
+    }
+
+
+def batch_ids(problem):
+    return [batch['batch_id'] for batch in problem['batches']]
+
+
+def class_count(problem):
+    return len(engine.expand_workload(problem['batch_subjects']))
@@ -0,0 +1,107 @@
+"""Versioned response cache for the public timetable endpoints.
+
+Every batch has a version counter in the `timetable_versions` table (see
+migrations.py). Anything
+that changes what a batch's timetable looks like (scheduler runs, repairs,
+slot edits, teacher/subject renames, deletes) bumps it in the same
+transaction as the change. Cached responses are stored with the version they
+were built from, so a lookup costs one primary-key read and is never stale
+across gunicorn workers, even though each worker keeps its own LRU.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import migrations
+
+# --- CONFIGURATION ---
+MAX_ENTRIES = int(os.environ.get('TIMETABLE_CACHE_MAX_ENTRIES', 5000))
+MAX_BYTES = int(os.environ.get('TIMETABLE_CACHE_MAX_BYTES', 32 * 2 ** 20))
+
+
+class LRUCache:
+    """A thread-safe LRU of byte bodies bounded by entry count and total size."""
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (version, body)
+        self._bytes = 0
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key, version):
+        """Returns the body cached for `key` at `version`, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[1]
+
+    def put(self, key, version, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._entries[key] = (version, body)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), bytes=self._bytes,
+                        max_entries=self.max_entries, max_bytes=self.max_bytes)
+
+
+timetables = LRUCache()
+
+
+# --- VERSION COUNTERS ---
+def get_version(cur, batch_id):
+    migrations.ensure_migrated()
+    cur.execute("SELECT version FROM timetable_versions WHERE batch_id = %s;", (batch_id,))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def bump_batches(cur, batch_ids):
+    """Invalidates the cached timetables of `batch_ids` when the caller commits."""
+    batch_ids = sorted(set(batch_ids))
+    if not batch_ids:
+        return
+    migrations.ensure_migrated()
+    cur.execute("""
+        INSERT INTO timetable_versions (batch_id, version)
+        SELECT batch_id, 1 FROM unnest(%s::int[]) AS batch_id
+        ON CONFLICT (batch_id) DO UPDATE SET version = timetable_versions.version + 1;
+    """, (batch_ids,))
+
+
+def bump_all(cur):
+    """Invalidates every batch's cached timetable when the caller commits."""
+    migrations.ensure_migrated()
+    cur.execute("""
+        INSERT INTO timetable_versions (batch_id, version)
+        SELECT batch_id, 1 FROM batches
+        ON CONFLICT (batch_id) DO UPDATE SET version = timetable_versions.version + 1;
+    """)
+
+
+def bump_where_used(cur, teacher_id=None, subject_id=None):
+    """Bumps the batches whose timetable shows `teacher_id` or `subject_id`."""
+    cur.execute("SELECT DISTINCT batch_id FROM timetable WHERE teacher_id = %s OR subject_id = %s;",
+                (teacher_id, subject_id))
+    bump_batches(cur, [row[0] for row in cur.fetchall()])
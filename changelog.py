@@ -0,0 +1,87 @@
+"""Change log behind the delta-sync mode of /admin/data/all.
+
+Row-level triggers on the admin tables (migration 4 in migrations.py) append
+the key of every inserted, updated or deleted row to `admin_changes`, with
+the id of the writing transaction. The version handed to the admin page is
+the xmin of the reading statement's snapshot: every transaction below it
+had finished, so its changes were in that response, while any change
+still in flight has a txid at or above it. `delta(since)` returns the
+current rows for keys changed by transactions from `since` on, and the keys
+that no longer exist. A change may be sent twice, which merging tolerates,
+but never skipped, and writers take no shared lock.
+
+Changes older than seven days are pruned as the log is written (see
+migration 4). A version at or below the pruned horizon gets a full snapshot.
+
+Both the full snapshot and the delta are built by one aggregated query that
+returns the finished JSON document as text.
+"""
+import migrations
+
+SYNC_TABLES = {
+    'teachers': ('teacher_id',),
+    'subjects': ('subject_id',),
+    'batches': ('batch_id',),
+    'teacher_subjects': ('teacher_id', 'subject_id'),
+    'batch_subjects': ('batch_id', 'subject_id'),
+}
+# Tried by the prune_admin_changes() trigger (migration 4); only one writer prunes at a time.
+CHANGELOG_LOCK_KEY = 7_304_113
+
+_VERSION_SQL = "pg_snapshot_xmin(pg_current_snapshot())::text::bigint"
+
+
+def _changed_keys(table, key_columns):
+    columns = ', '.join(f"(c.row_key ->> '{column}')::int" for column in key_columns)
+    return (f"SELECT {columns} FROM admin_changes c "
+            f"WHERE c.txid >= %(since)s AND c.table_name = '{table}'")
+
+
+def _snapshot_sql():
+    parts = [f"'version', {_VERSION_SQL}", "'full', true"]
+    for table, key_columns in SYNC_TABLES.items():
+        order = ', '.join(key_columns)
+        parts.append(f"'{table}', (SELECT coalesce(json_agg(r ORDER BY {order}), '[]') FROM {table} r)")
+    return f"SELECT json_build_object({', '.join(parts)})::text;"
+
+
+def _delta_sql():
+    parts = [f"'version', {_VERSION_SQL}", "'full', false"]
+    for table, key_columns in SYNC_TABLES.items():
+        order = ', '.join(key_columns)
+        row_columns = ', '.join(f"r.{column}" for column in key_columns)
+        key_match = ' AND '.join(f"r.{column} = (c.row_key ->> '{column}')::int" for column in key_columns)
+        upserts = (f"(SELECT coalesce(json_agg(r ORDER BY {order}), '[]') FROM {table} r "
+                   f"WHERE ({row_columns}) IN ({_changed_keys(table, key_columns)}))")
+        deletes = (f"(SELECT coalesce(json_agg(DISTINCT c.row_key), '[]') FROM admin_changes c "
+                   f"WHERE c.txid >= %(since)s AND c.table_name = '{table}' "
+                   f"AND NOT EXISTS (SELECT 1 FROM {table} r WHERE {key_match}))")
+        parts.append(f"'{table}', json_build_object('upserts', {upserts}, 'deletes', {deletes})")
+    return f"SELECT json_build_object({', '.join(parts)})::text;"
+
+
+SNAPSHOT_SQL = _snapshot_sql()
+DELTA_SQL = _delta_sql()
+
+
+def snapshot(cur):
+    """Every row of the admin tables plus the current version, as a JSON string."""
+    migrations.ensure_migrated()
+    cur.execute(SNAPSHOT_SQL)
+    return cur.fetchone()[0]
+
+
+def delta(cur, since):
+    """Rows changed and keys deleted since version `since`, as a JSON string.
+
+    Falls back to a full snapshot when `since` is not a position the log can
+    answer from (ahead of it after a database reset, or at or below the
+    pruned horizon).
+    """
+    migrations.ensure_migrated()
+    cur.execute(f"SELECT {_VERSION_SQL}, (SELECT pruned_through FROM admin_changes_horizon);")
+    version, pruned_through = cur.fetchone()
+    if since > version or since <= (pruned_through or 0):
+        return snapshot(cur)
+    cur.execute(DELTA_SQL, {'since': since})
+    return cur.fetchone()[0]
@@ -0,0 +1,959 @@
+"""The database-independent scheduling core.
+
+Everything here works on plain Python data, so the algorithm can be run,
+benchmarked and profiled without Postgres. `scheduler.py` is the adapter
+that loads a problem from the database and persists the placements.
+
+A problem is a dict of lists of row dicts, shaped like the tables they come from:
+
+    subjects          [{'subject_id', 'subject_name', 'max_per_day', ...}]
+    teachers          [{'teacher_id', 'max_classes_per_week', ...}]
+    teacher_subjects  [{'teacher_id', 'subject_id'}]
+    batch_subjects    [{'batch_id', 'subject_id', 'classes_per_week'}]  # the workload to place
+    commitments       [{'batch_id', 'subject_id', 'teacher_id', 'day_of_week', 'period'}]  # timetable rows kept as-is
+
+and may carry `batches` ([{'batch_id', 'department'}], used for partitioning)
+and `unavailable` ({teacher_id: slot mask} a teacher cannot be booked into).
+"""
+import heapq
+import multiprocessing
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# --- CONFIGURATION ---
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+PERIODS_PER_DAY = 5
+LUNCH_BREAK_PERIOD = 3
+
+# --- SLOT OCCUPANCY ---
+# Every (day, period) in the week maps to one bit, so a teacher's or batch's
+# commitments fit in a single integer and free-slot checks are bitwise ops.
+SLOTS = [(day, period) for day in DAYS for period in range(1, PERIODS_PER_DAY + 1)]
+SLOT_INDEX = {slot: i for i, slot in enumerate(SLOTS)}
+TEACHING_MASK = sum(1 << i for i, (_, period) in enumerate(SLOTS) if period != LUNCH_BREAK_PERIOD)
+TEACHING_SLOT_COUNT = bin(TEACHING_MASK).count('1')
+DAY_MASKS = [sum(1 << SLOT_INDEX[(day, period)] for period in range(1, PERIODS_PER_DAY + 1)) for day in DAYS]
+
+MODES = ['search', 'matching', 'random']
+
+# --- SEARCH TUNING ---
+# Seconds the search may spend backtracking before it finishes greedily.
+DEFAULT_TIME_BUDGET = 10.0
+# Candidate (slot, teacher) pairs tried per placement before giving in.
+SEARCH_BRANCHING = 8
+# Bounds on how often placed classes may be displaced to make room.
+MAX_EJECTIONS_PER_DEMAND = 8
+MAX_EJECTIONS_PER_CLASS = 20
+
+
+def slot_bit(day, period):
+    """Returns the occupancy bit for a (day, period) pair."""
+    return 1 << SLOT_INDEX[(day, period)]
+
+
+def iter_slots(mask):
+    """Yields the slot indices whose bits are set in `mask`, lowest first."""
+    while mask:
+        low_bit = mask & -mask
+        yield low_bit.bit_length() - 1
+        mask ^= low_bit
+
+
+def build_subject_index(teacher_subject_links):
+    """Maps each subject_id to the list of teacher_ids qualified to teach it."""
+    qualified = {}
+    for link in teacher_subject_links:
+        qualified.setdefault(link['subject_id'], []).append(link['teacher_id'])
+    return qualified
+
+
+def build_occupancy(commitments, batch_ids):
+    """Folds existing timetable rows into per-teacher and per-batch bitmasks."""
+    teacher_busy = {}
+    batch_busy = {b_id: 0 for b_id in batch_ids}
+    for row in commitments:
+        bit = slot_bit(row['day_of_week'], row['period'])
+        teacher_busy[row['teacher_id']] = teacher_busy.get(row['teacher_id'], 0) | bit
+        if row['batch_id'] in batch_busy:
+            batch_busy[row['batch_id']] |= bit
+    return teacher_busy, batch_busy
+
+
+def expand_workload(batch_subjects):
+    """One (batch_id, subject_id) entry per class that has to be placed."""
+    classes = []
+    for item in batch_subjects:
+        for _ in range(item['classes_per_week']):
+            classes.append((item['batch_id'], item['subject_id']))
+    return classes
+
+
+class Occupancy:
+    """Mutable slot occupancy plus the load counters behind the per-day and weekly caps.
+
+    `max_per_day` on a subject limits how often one batch has it on a single
+    day; `max_classes_per_week` on a teacher limits their total load. Empty
+    or zero values mean "no limit".
+    """
+
+    def __init__(self, problem, batch_ids):
+        self.teacher_busy, self.batch_busy = build_occupancy(problem['commitments'], batch_ids)
+        for t_id, mask in problem.get('unavailable', {}).items():
+            self.teacher_busy[t_id] = self.teacher_busy.get(t_id, 0) | mask
+        self.teacher_cap = {t['teacher_id']: t.get('max_classes_per_week') or None for t in problem['teachers']}
+        self.subject_cap = {s['subject_id']: s.get('max_per_day') or None for s in problem['subjects']}
+        self.teacher_load = {}
+        self.day_count = {}
+        for row in problem['commitments']:
+            self.teacher_load[row['teacher_id']] = self.teacher_load.get(row['teacher_id'], 0) + 1
+            if row['batch_id'] in self.batch_busy and row.get('subject_id') is not None:
+                counts = self.day_counts(row['batch_id'], row['subject_id'])
+                counts[SLOT_INDEX[(row['day_of_week'], row['period'])] // PERIODS_PER_DAY] += 1
+
+    def day_counts(self, batch_id, subject_id):
+        counts = self.day_count.get((batch_id, subject_id))
+        if counts is None:
+            counts = self.day_count[(batch_id, subject_id)] = [0] * len(DAYS)
+        return counts
+
+    def teacher_room(self, teacher_id):
+        """Classes the teacher may still take this week (None when uncapped)."""
+        cap = self.teacher_cap.get(teacher_id)
+        return None if cap is None else cap - self.teacher_load.get(teacher_id, 0)
+
+    def teacher_available(self, teacher_id):
+        room = self.teacher_room(teacher_id)
+        return room is None or room > 0
+
+    def free_mask(self, batch_id, subject_id):
+        """Teaching slots where the batch is free and the subject's daily cap is not reached."""
+        mask = TEACHING_MASK & ~self.batch_busy[batch_id]
+        cap = self.subject_cap.get(subject_id)
+        if cap:
+            for day_index, count in enumerate(self.day_counts(batch_id, subject_id)):
+                if count >= cap:
+                    mask &= ~DAY_MASKS[day_index]
+        return mask
+
+    def teacher_free_mask(self, teacher_id, base):
+        if not self.teacher_available(teacher_id):
+            return 0
+        return base & ~self.teacher_busy.get(teacher_id, 0)
+
+    def place(self, batch_id, subject_id, teacher_id, slot_index):
+        bit = 1 << slot_index
+        self.batch_busy[batch_id] |= bit
+        self.teacher_busy[teacher_id] = self.teacher_busy.get(teacher_id, 0) | bit
+        self.teacher_load[teacher_id] = self.teacher_load.get(teacher_id, 0) + 1
+        self.day_counts(batch_id, subject_id)[slot_index // PERIODS_PER_DAY] += 1
+
+    def unplace(self, batch_id, subject_id, teacher_id, slot_index):
+        bit = 1 << slot_index
+        self.batch_busy[batch_id] &= ~bit
+        self.teacher_busy[teacher_id] &= ~bit
+        self.teacher_load[teacher_id] -= 1
+        self.day_counts(batch_id, subject_id)[slot_index // PERIODS_PER_DAY] -= 1
+
+
+def schedule(problem, batch_ids, mode='search', rng=None, progress=None, time_budget=DEFAULT_TIME_BUDGET):
+    """Places every class of `problem['batch_subjects']` for `batch_ids`.
+
+    `mode` is 'search' (deterministic most-constrained-first search, see
+    _Search), 'matching' (slot-by-slot bipartite matching of batches to
+    teachers, see _SlotMatching) or 'random' (the original randomized first
+    fit). Returns a dict
+    with `placements` as (batch_id, subject_id, teacher_id, day, period)
+    tuples, the placed/total counts, a `failures` list describing each
+    class that could not be placed, and `timings`: seconds spent expanding
+    the workload into demands ('expand') and placing them ('place').
+    """
+    started = time.perf_counter()
+    if mode == 'search':
+        runner = _Search(problem, batch_ids, rng or random.Random(0), progress, time_budget)
+    elif mode == 'matching':
+        runner = _SlotMatching(problem, batch_ids, rng or random.Random(0), progress, time_budget)
+    elif mode == 'random':
+        runner = _RandomFirstFit(problem, batch_ids, rng or random.Random(), progress)
+    else:
+        raise ValueError(f"Unknown scheduling mode: {mode}")
+    expanded = time.perf_counter()
+    result = runner.run()
+    result['timings'] = {'expand': expanded - started, 'place': time.perf_counter() - expanded}
+    return result
+
+
+class _RandomFirstFit:
+    """Randomized first fit: each class, in table order, takes a random valid slot."""
+
+    def __init__(self, problem, batch_ids, rng, progress):
+        self.rng = rng
+        self.progress = progress
+        self.subjects_map = {row['subject_id']: row for row in problem['subjects']}
+        self.qualified = build_subject_index(problem['teacher_subjects'])
+        self.occupancy = Occupancy(problem, batch_ids)
+        wanted = set(batch_ids)
+        self.classes = expand_workload(item for item in problem['batch_subjects'] if item['batch_id'] in wanted)
+
+    def run(self):
+        rng, occupancy = self.rng, self.occupancy
+        placements = []
+        failures = []
+        total = len(self.classes)
+        for batch_id, subject_id in self.classes:
+            qualified_teachers = self.qualified.get(subject_id)
+            if not qualified_teachers:
+                failures.append(_failure(self.subjects_map, batch_id, subject_id, 'No qualified teachers'))
+                continue
+
+            # A slot is valid when the batch is free and at least one qualified teacher is.
+            batch_free = occupancy.free_mask(batch_id, subject_id)
+            free_by_teacher = {t_id: occupancy.teacher_free_mask(t_id, batch_free) for t_id in qualified_teachers}
+            valid_mask = 0
+            for mask in free_by_teacher.values():
+                valid_mask |= mask
+
+            if valid_mask:
+                slot_index = rng.choice(list(iter_slots(valid_mask)))
+                bit = 1 << slot_index
+                teacher_id = rng.choice([t_id for t_id, mask in free_by_teacher.items() if mask & bit])
+                day, period = SLOTS[slot_index]
+
+                placements.append((batch_id, subject_id, teacher_id, day, period))
+                occupancy.place(batch_id, subject_id, teacher_id, slot_index)
+                if self.progress:
+                    self.progress(len(placements), total)
+            else:
+                failures.append(_failure(self.subjects_map, batch_id, subject_id, 'No valid slot'))
+
+        return {'placements': placements, 'placed': len(placements), 'total': total, 'failures': failures}
+
+
+class _Search:
+    """Most-constrained-first placement with forward checking and repair on dead ends.
+
+    The workload is grouped into demands (batch, subject, classes still to
+    place). The demand with the least slack (placeable slots minus classes
+    left) is always placed next, onto the candidate slot/teacher that keeps
+    the most options open. A candidate is rejected if it would leave some
+    other demand of the same batch or teacher with fewer slots than classes.
+    When a demand has no slot at all, the search backtracks non-chronologically:
+    it undoes the earlier placement that blocks it (same batch or same teacher,
+    in a slot it could use), takes that slot, and requeues the displaced class.
+    Backtracking stops once `time_budget` seconds or MAX_EJECTIONS are used
+    up, after which the remaining classes are placed without it.
+    """
+
+    def __init__(self, problem, batch_ids, rng, progress, time_budget):
+        self.rng = rng
+        self.progress = progress
+        self.deadline = time.monotonic() + time_budget if time_budget is not None else None
+        self.subjects_map = {row['subject_id']: row for row in problem['subjects']}
+        self.occupancy = Occupancy(problem, batch_ids)
+        qualified = build_subject_index(problem['teacher_subjects'])
+
+        wanted = set(batch_ids)
+        remaining = {}
+        for item in problem['batch_subjects']:
+            if item['batch_id'] in wanted and item['classes_per_week'] > 0:
+                key = (item['batch_id'], item['subject_id'])
+                remaining[key] = remaining.get(key, 0) + item['classes_per_week']
+
+        self.batch = []
+        self.subject = []
+        self.teachers = []
+        self.remaining = []
+        self.by_batch = {}
+        self.by_teacher = {}
+        for (batch_id, subject_id), classes in remaining.items():
+            d = len(self.batch)
+            self.batch.append(batch_id)
+            self.subject.append(subject_id)
+            self.teachers.append(qualified.get(subject_id, []))
+            self.remaining.append(classes)
+            self.by_batch.setdefault(batch_id, []).append(d)
+            for t_id in self.teachers[d]:
+                self.by_teacher.setdefault(t_id, []).append(d)
+        self.total = sum(self.remaining)
+
+        # Prefer teachers whose subjects are in low demand relative to their staff.
+        teacher_count = {s_id: len(t_ids) for s_id, t_ids in qualified.items()}
+        self.pressure = {}
+        for d, t_ids in enumerate(self.teachers):
+            for t_id in t_ids:
+                self.pressure[t_id] = self.pressure.get(t_id, 0) + self.remaining[d] / teacher_count[self.subject[d]]
+
+        self.capacity = [0] * len(self.batch)
+        self.version = [0] * len(self.batch)
+        self.ejections = [0] * len(self.batch)
+        self.heap = []
+        self.placements = {}  # placement id -> (demand, teacher_id, slot_index)
+        self.at_batch_slot = {}
+        self.at_teacher_slot = {}
+        self.next_placement_id = 0
+        self.failures = []
+        self.total_ejections = 0
+        for d in range(len(self.batch)):
+            self._refresh(d)
+
+    def warm_start(self, placements):
+        """Applies (batch_id, subject_id, teacher_id, slot_index) placements before the search runs.
+
+        They count as the search's own placements, so backtracking may still
+        displace them.
+        """
+        demand = {(self.batch[d], self.subject[d]): d for d in range(len(self.batch))}
+        for batch_id, subject_id, teacher_id, slot_index in placements:
+            self._apply(demand[(batch_id, subject_id)], teacher_id, slot_index)
+        for d in range(len(self.batch)):
+            self._refresh(d)
+        return self
+
+    # --- demand bookkeeping ---
+    def _capacity(self, d):
+        """How many more classes demand `d` could take given current occupancy."""
+        occupancy = self.occupancy
+        base = occupancy.free_mask(self.batch[d], self.subject[d])
+        union = 0
+        room = 0
+        for t_id in self.teachers[d]:
+            free = occupancy.teacher_free_mask(t_id, base)
+            if free:
+                union |= free
+                t_room = occupancy.teacher_room(t_id)
+                room = None if room is None or t_room is None else room + t_room
+        if not union:
+            return 0
+        cap = occupancy.subject_cap.get(self.subject[d])
+        counts = occupancy.day_counts(self.batch[d], self.subject[d])
+        slots = 0
+        for day_index, day_mask in enumerate(DAY_MASKS):
+            free_today = bin(union & day_mask).count('1')
+            slots += min(free_today, cap - counts[day_index]) if cap else free_today
+        return slots if room is None else min(slots, room)
+
+    def _refresh(self, d):
+        """Recomputes a demand's capacity and requeues it; returns False if it was just starved."""
+        before = self.capacity[d]
+        after = self.capacity[d] = self._capacity(d)
+        self.version[d] += 1
+        if self.remaining[d] > 0:
+            slack = after - self.remaining[d]
+            heapq.heappush(self.heap, (slack, len(self.teachers[d]), d, self.version[d]))
+        return not (after < self.remaining[d] <= before)
+
+    def _refresh_around(self, d, teacher_id):
+        ok = True
+        for e in set(self.by_batch[self.batch[d]]).union(self.by_teacher.get(teacher_id, ())):
+            ok = self._refresh(e) and ok
+        return ok
+
+    def _pop(self):
+        while self.heap:
+            _, _, d, version = heapq.heappop(self.heap)
+            if version == self.version[d] and self.remaining[d] > 0:
+                return d
+        return None
+
+    # --- placement ---
+    def _apply(self, d, teacher_id, slot_index):
+        pid = self.next_placement_id
+        self.next_placement_id += 1
+        self.placements[pid] = (d, teacher_id, slot_index)
+        self.at_batch_slot[(self.batch[d], slot_index)] = pid
+        self.at_teacher_slot[(teacher_id, slot_index)] = pid
+        self.occupancy.place(self.batch[d], self.subject[d], teacher_id, slot_index)
+        self.remaining[d] -= 1
+        return pid
+
+    def _undo(self, pid):
+        d, teacher_id, slot_index = self.placements.pop(pid)
+        del self.at_batch_slot[(self.batch[d], slot_index)]
+        del self.at_teacher_slot[(teacher_id, slot_index)]
+        self.occupancy.unplace(self.batch[d], self.subject[d], teacher_id, slot_index)
+        self.remaining[d] += 1
+        return d, teacher_id, slot_index
+
+    def _candidates(self, d):
+        """(slot, teacher) options for `d`, least constraining first."""
+        occupancy = self.occupancy
+        base = occupancy.free_mask(self.batch[d], self.subject[d])
+        counts = occupancy.day_counts(self.batch[d], self.subject[d])
+        ranked = []
+        for t_id in self.teachers[d]:
+            free = occupancy.teacher_free_mask(t_id, base)
+            busy = occupancy.teacher_busy.get(t_id, 0)
+            for slot_index in iter_slots(free):
+                day_index = slot_index // PERIODS_PER_DAY
+                teacher_day_load = bin(busy & DAY_MASKS[day_index]).count('1')
+                ranked.append(((counts[day_index], teacher_day_load, self.pressure[t_id], self.rng.random()),
+                               slot_index, t_id))
+        ranked.sort()
+        return [(slot_index, t_id) for _, slot_index, t_id in ranked[:SEARCH_BRANCHING]]
+
+    def _place_best(self, d):
+        candidates = self._candidates(d)
+        for slot_index, t_id in candidates:
+            pid = self._apply(d, t_id, slot_index)
+            if self._refresh_around(d, t_id):
+                return True
+            self._undo(pid)
+            self._refresh_around(d, t_id)
+        if candidates:
+            # Every option starves a neighbour; take the best one and let it cope.
+            slot_index, t_id = candidates[0]
+            self._apply(d, t_id, slot_index)
+            self._refresh_around(d, t_id)
+            return True
+        return False
+
+    def _backtrack_into(self, d):
+        """Undoes one earlier placement that blocks `d` and gives its slot to `d`."""
+        occupancy = self.occupancy
+        batch_id, subject_id = self.batch[d], self.subject[d]
+        allowed = occupancy.free_mask(batch_id, subject_id) | (TEACHING_MASK & occupancy.batch_busy[batch_id])
+        options = []
+        for slot_index in iter_slots(allowed):
+            blocker = self.at_batch_slot.get((batch_id, slot_index))
+            if blocker is not None:
+                if self.placements[blocker][0] != d:
+                    options.append((blocker, slot_index))
+                continue
+            for t_id in self.teachers[d]:
+                blocker = self.at_teacher_slot.get((t_id, slot_index))
+                if blocker is not None:
+                    options.append((blocker, slot_index))
+        # Displace the class that is easiest to re-place and has moved least.
+        options.sort(key=lambda option: (
+            self.ejections[self.placements[option[0]][0]],
+            -(self.capacity[self.placements[option[0]][0]] - self.remaining[self.placements[option[0]][0]]),
+            option[1],
+        ))
+        for blocker, slot_index in options:
+            e = self.placements[blocker][0]
+            if self.ejections[e] >= MAX_EJECTIONS_PER_DEMAND:
+                continue
+            undone = self._undo(blocker)
+            bit = 1 << slot_index
+            if occupancy.free_mask(batch_id, subject_id) & bit:
+                for t_id in self.teachers[d]:
+                    if occupancy.teacher_free_mask(t_id, bit):
+                        self._apply(d, t_id, slot_index)
+                        self.ejections[e] += 1
+                        self.total_ejections += 1
+                        self._refresh_around(e, undone[1])
+                        self._refresh_around(d, t_id)
+                        return True
+            self._apply(*undone)
+        return False
+
+    def _can_backtrack(self):
+        if self.total_ejections >= MAX_EJECTIONS_PER_CLASS * self.total:
+            return False
+        return self.deadline is None or time.monotonic() < self.deadline
+
+    def run(self):
+        while True:
+            d = self._pop()
+            if d is None:
+                break
+            if not self.teachers[d]:
+                for _ in range(self.remaining[d]):
+                    self.failures.append(_failure(self.subjects_map, self.batch[d], self.subject[d], 'No qualified teachers'))
+                self.remaining[d] = 0
+                continue
+            if not self._place_best(d):
+                # Displacing classes cannot help when every qualified teacher is fully booked.
+                at_limit = not any(self.occupancy.teacher_available(t_id) for t_id in self.teachers[d])
+                if at_limit or not (self._can_backtrack() and self._backtrack_into(d)):
+                    reason = 'Qualified teachers at weekly limit' if at_limit else 'No valid slot'
+                    self.failures.append(_failure(self.subjects_map, self.batch[d], self.subject[d], reason))
+                    self.remaining[d] -= 1
+                    self._refresh(d)
+            if self.progress:
+                self.progress(len(self.placements), self.total)
+
+        placements = []
+        for d, t_id, slot_index in self.placements.values():
+            day, period = SLOTS[slot_index]
+            placements.append((self.batch[d], self.subject[d], t_id, day, period))
+        return {'placements': placements, 'placed': len(placements), 'total': self.total, 'failures': self.failures}
+
+
+class _SlotMatching:
+    """Slot-by-slot assignment by maximum bipartite matching of batches to teachers.
+
+    Teaching slots are visited period-first across the week (every day's
+    first period, then every day's second, ...), which keeps days compact and
+    spreads each subject over the week. At each slot the free batches with
+    classes left are matched to the free teachers with weekly room left; an
+    edge means the teacher can take one of the batch's pending subjects
+    today. A greedy pass in priority order, completed by Hopcroft-Karp
+    augmentation, gives a maximum matching that favours the most urgent
+    batches (most classes left per remaining free slot) and, for each batch,
+    the least scarce teachers (lowest demand on their subjects relative to
+    the staff qualified for them), then those with the most weekly room.
+    Classes no matching could take are finally handed to _Search, warm-started
+    with the matched placements.
+    """
+
+    def __init__(self, problem, batch_ids, rng, progress, time_budget):
+        self.problem = problem
+        self.batch_ids = batch_ids
+        self.rng = rng
+        self.progress = progress
+        self.time_budget = time_budget
+        self.occupancy = Occupancy(problem, batch_ids)
+        self.qualified = build_subject_index(problem['teacher_subjects'])
+
+        wanted = set(batch_ids)
+        self.remaining = {}
+        for item in problem['batch_subjects']:
+            if item['batch_id'] in wanted and item['classes_per_week'] > 0:
+                key = (item['batch_id'], item['subject_id'])
+                self.remaining[key] = self.remaining.get(key, 0) + item['classes_per_week']
+        self.subjects_of = {}
+        for batch_id, subject_id in self.remaining:
+            self.subjects_of.setdefault(batch_id, []).append(subject_id)
+        self.total = sum(self.remaining.values())
+        self.placements = []
+        self.slot_order = [SLOT_INDEX[(day, period)] for period in range(1, PERIODS_PER_DAY + 1)
+                           if period != LUNCH_BREAK_PERIOD for day in DAYS]
+
+    def _subject_scarcity(self):
+        """Classes still wanted per class of weekly room among qualified teachers, per subject."""
+        demand = {}
+        for (_, subject_id), classes in self.remaining.items():
+            if classes:
+                demand[subject_id] = demand.get(subject_id, 0) + classes
+        scarcity = {}
+        for subject_id, classes in demand.items():
+            room = 0
+            for t_id in self.qualified.get(subject_id, ()):
+                t_room = self.occupancy.teacher_room(t_id)
+                room += TEACHING_SLOT_COUNT if t_room is None else max(t_room, 0)
+            scarcity[subject_id] = classes / room if room else float('inf')
+        return scarcity
+
+    def _graph(self, slot_index, slots_ahead):
+        """Left vertices in priority order, their ranked teachers, and the subject on each edge."""
+        occupancy = self.occupancy
+        bit = 1 << slot_index
+        scarcity = self._subject_scarcity()
+        pressure = {}
+        for subject_id, value in scarcity.items():
+            for t_id in self.qualified.get(subject_id, ()):
+                pressure[t_id] = pressure.get(t_id, 0) + value
+
+        ranked_batches = []
+        adjacency = {}
+        edge_subject = {}
+        for batch_id, subject_ids in self.subjects_of.items():
+            if occupancy.batch_busy[batch_id] & bit:
+                continue
+            pending = [s_id for s_id in subject_ids
+                       if self.remaining[(batch_id, s_id)] and occupancy.free_mask(batch_id, s_id) & bit]
+            if not pending:
+                continue
+            ahead = slots_ahead & ~occupancy.batch_busy[batch_id]
+            slack = {s_id: self._slots_left(batch_id, s_id, ahead) - self.remaining[(batch_id, s_id)]
+                     for s_id in pending}
+            # Subjects running out of usable slots go first, then scarce ones, so
+            # they get the teachers only they can use.
+            pending.sort(key=lambda s_id: (slack[s_id], -scarcity[s_id], -self.remaining[(batch_id, s_id)]))
+            teachers = {}
+            for s_id in pending:
+                for t_id in self.qualified.get(s_id, ()):
+                    if t_id not in teachers and occupancy.teacher_free_mask(t_id, bit):
+                        teachers[t_id] = s_id
+            if not teachers:
+                continue
+            left = sum(self.remaining[(batch_id, s_id)] for s_id in subject_ids)
+            free_ahead = bin(ahead).count('1')
+            ranked_batches.append((min(slack.values()), free_ahead - left, self.rng.random(), batch_id))
+            adjacency[batch_id] = sorted(teachers, key=lambda t_id: (
+                pressure.get(t_id, 0), -(occupancy.teacher_room(t_id) or TEACHING_SLOT_COUNT), t_id))
+            for t_id, s_id in teachers.items():
+                edge_subject[(batch_id, t_id)] = s_id
+        ranked_batches.sort()
+        return [ranked[-1] for ranked in ranked_batches], adjacency, edge_subject
+
+    def _slots_left(self, batch_id, subject_id, ahead):
+        """Slots in `ahead` the subject could still use, given its daily cap."""
+        cap = self.occupancy.subject_cap.get(subject_id)
+        if not cap:
+            return bin(ahead).count('1')
+        counts = self.occupancy.day_counts(batch_id, subject_id)
+        return sum(max(0, min(bin(ahead & day_mask).count('1'), cap - counts[day_index]))
+                   for day_index, day_mask in enumerate(DAY_MASKS))
+
+    @staticmethod
+    def _max_matching(order, adjacency):
+        """Greedy matching in `order`, augmented to maximum cardinality by Hopcroft-Karp.
+
+        Augmenting paths never unmatch a left vertex, so every batch the
+        greedy pass matched stays matched.
+        """
+        match_left, match_right = {}, {}
+        for u in order:
+            for t_id in adjacency[u]:
+                if t_id not in match_right:
+                    match_left[u] = t_id
+                    match_right[t_id] = u
+                    break
+
+        while True:
+            dist = {}
+            queue = deque()
+            for u in order:
+                if u not in match_left:
+                    dist[u] = 0
+                    queue.append(u)
+            found = False
+            while queue:
+                u = queue.popleft()
+                for t_id in adjacency[u]:
+                    w = match_right.get(t_id)
+                    if w is None:
+                        found = True
+                    elif w not in dist:
+                        dist[w] = dist[u] + 1
+                        queue.append(w)
+            if not found:
+                return match_left
+
+            pointer = dict.fromkeys(dist, 0)
+            for root in order:
+                if root in match_left or dist.get(root) != 0:
+                    continue
+                stack = [root]
+                while stack:
+                    u = stack[-1]
+                    if pointer[u] >= len(adjacency[u]):
+                        dist[u] = None  # dead end for this phase
+                        stack.pop()
+                        continue
+                    t_id = adjacency[u][pointer[u]]
+                    pointer[u] += 1
+                    w = match_right.get(t_id)
+                    if w is None:
+                        for v in stack:
+                            taken = adjacency[v][pointer[v] - 1]
+                            match_left[v] = taken
+                            match_right[taken] = v
+                        break
+                    if dist[u] is not None and dist.get(w) == dist[u] + 1:
+                        stack.append(w)
+
+    def run(self):
+        slots_ahead = sum(1 << slot_index for slot_index in self.slot_order)
+        for slot_index in self.slot_order:
+            order, adjacency, edge_subject = self._graph(slot_index, slots_ahead)
+            slots_ahead &= ~(1 << slot_index)
+            if not order:
+                continue
+            for batch_id, t_id in self._max_matching(order, adjacency).items():
+                subject_id = edge_subject[(batch_id, t_id)]
+                self.occupancy.place(batch_id, subject_id, t_id, slot_index)
+                self.remaining[(batch_id, subject_id)] -= 1
+                day, period = SLOTS[slot_index]
+                self.placements.append((batch_id, subject_id, t_id, day, period))
+            if self.progress:
+                self.progress(len(self.placements), self.total)
+
+        if not any(self.remaining.values()):
+            return {'placements': self.placements, 'placed': len(self.placements), 'total': self.total,
+                    'failures': []}
+        # The search places what the matchings left over, moving matched classes
+        # out of the way where that helps.
+        search = _Search(self.problem, self.batch_ids, self.rng, self.progress, self.time_budget)
+        return search.warm_start(
+            (batch_id, subject_id, t_id, SLOT_INDEX[(day, period)])
+            for batch_id, subject_id, t_id, day, period in self.placements
+        ).run()
+
+
+def _failure(subjects_map, batch_id, subject_id, reason):
+    subject = subjects_map.get(subject_id)
+    return {
+        'batch_id': batch_id,
+        'subject_id': subject_id,
+        'subject_name': subject['subject_name'] if subject else None,
+        'reason': reason,
+    }
+
+
+# --- SCORING & MULTI-START ---
+# Penalty weights; lower scores are better. An unplaced class outweighs any
+# amount of cosmetic quality.
+SCORE_WEIGHTS = {'unplaced': 1000, 'idle_gaps': 10, 'same_subject_repeats': 5, 'teacher_load_imbalance': 1}
+
+
+def score_schedule(problem, result, batch_ids):
+    """Scores a schedule for `batch_ids` (its placements plus kept commitments of those batches).
+
+    Components: classes left unplaced, idle periods between a batch's first
+    and last class of a day, a subject taught to a batch more than once on
+    the same day, and each teacher's spread between their busiest and
+    quietest day.
+    """
+    wanted = set(batch_ids)
+    rows = [(c['batch_id'], c.get('subject_id'), c['teacher_id'], SLOT_INDEX[(c['day_of_week'], c['period'])])
+            for c in problem['commitments'] if c['batch_id'] in wanted]
+    rows.extend((b_id, s_id, t_id, SLOT_INDEX[(day, period)]) for b_id, s_id, t_id, day, period in result['placements'])
+
+    batch_masks = {}
+    teacher_day_loads = {}
+    subject_days = {}
+    for b_id, s_id, t_id, slot_index in rows:
+        day_index = slot_index // PERIODS_PER_DAY
+        batch_masks[b_id] = batch_masks.get(b_id, 0) | (1 << slot_index)
+        teacher_day_loads.setdefault(t_id, [0] * len(DAYS))[day_index] += 1
+        subject_days[(b_id, s_id, day_index)] = subject_days.get((b_id, s_id, day_index), 0) + 1
+
+    idle_gaps = 0
+    for mask in batch_masks.values():
+        for day_mask in DAY_MASKS:
+            day_slots = list(iter_slots(mask & day_mask))
+            if day_slots:
+                span = (1 << (day_slots[-1] + 1)) - (1 << day_slots[0])
+                idle_gaps += bin(span & day_mask & TEACHING_MASK & ~mask).count('1')
+
+    components = {
+        'unplaced': len(result['failures']),
+        'idle_gaps': idle_gaps,
+        'same_subject_repeats': sum(count - 1 for count in subject_days.values()),
+        'teacher_load_imbalance': sum(max(loads) - min(loads) for loads in teacher_day_loads.values()),
+    }
+    components['total'] = sum(SCORE_WEIGHTS[name] * value for name, value in components.items())
+    return components
+
+
+_worker_problem = None
+
+
+def _init_attempt_worker(problem, batch_ids, mode, time_budget):
+    global _worker_problem
+    _worker_problem = (problem, batch_ids, mode, time_budget)
+
+
+def _run_attempt(seed):
+    problem, batch_ids, mode, time_budget = _worker_problem
+    return _seeded_attempt(problem, batch_ids, mode, time_budget, seed)
+
+
+def _seeded_attempt(problem, batch_ids, mode, time_budget, seed, progress=None):
+    result = schedule(problem, batch_ids, mode=mode, rng=random.Random(seed), progress=progress,
+                      time_budget=time_budget)
+    result['seed'] = seed
+    result['score'] = score_schedule(problem, result, batch_ids)
+    return result
+
+
+def schedule_best(problem, batch_ids, attempts, mode='search', seed=None, time_budget=DEFAULT_TIME_BUDGET,
+                  workers=None, progress=None):
+    """Runs `attempts` seeded schedules in parallel processes and returns the best-scoring one.
+
+    Attempt i uses seed `seed + i`. Without a seed, search and matching runs start from
+    0 (so they stay deterministic) and random runs from a random base. The winner's `seed` and `score` are included in the result, so rerunning
+    with that seed and attempts=1 reproduces it. `progress(placed, total)`
+    reports the best attempt finished so far.
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 31) if mode == 'random' else 0
+    base_seed = seed
+    seeds = [base_seed + i for i in range(attempts)]
+    if attempts <= 1:
+        return _seeded_attempt(problem, batch_ids, mode, time_budget, base_seed, progress)
+
+    workers = min(attempts, workers or os.cpu_count() or 1)
+    results = []
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_attempt_worker,
+                             initargs=(problem, batch_ids, mode, time_budget)) as pool:
+        for result in as_completed([pool.submit(_run_attempt, s) for s in seeds]):
+            results.append(result.result())
+            if progress:
+                best_so_far = max(results, key=lambda r: r['placed'])
+                progress(best_so_far['placed'], best_so_far['total'])
+
+    best = min(results, key=lambda r: (r['score']['total'], r['seed']))
+    best['attempts'] = sorted(({'seed': r['seed'], 'score': r['score']} for r in results), key=lambda a: a['seed'])
+    return best
+
+
+# --- PARTITIONED SCHEDULING ---
+def partition_batches(problem, batch_ids):
+    """Splits `batch_ids` into groups that share no department-local teachers.
+
+    Batches are linked whenever one teacher is qualified for subjects both of
+    them take. Teachers whose batches span several departments (per
+    `problem['batches']`) do not link anything, otherwise a handful of them
+    would glue the whole institution into one group; they are returned
+    separately, and schedule_partitioned resolves their clashes after merging.
+    """
+    department = {row['batch_id']: row.get('department') for row in problem.get('batches', [])}
+    qualified = build_subject_index(problem['teacher_subjects'])
+    wanted = set(batch_ids)
+    batches_by_teacher = {}
+    for item in problem['batch_subjects']:
+        if item['batch_id'] in wanted:
+            for t_id in qualified.get(item['subject_id'], ()):
+                batches_by_teacher.setdefault(t_id, set()).add(item['batch_id'])
+
+    parent = {b_id: b_id for b_id in batch_ids}
+
+    def find(b_id):
+        while parent[b_id] != b_id:
+            parent[b_id] = parent[parent[b_id]]
+            b_id = parent[b_id]
+        return b_id
+
+    shared_teachers = set()
+    for t_id, t_batches in batches_by_teacher.items():
+        if len({department.get(b_id) for b_id in t_batches}) > 1:
+            shared_teachers.add(t_id)
+            continue
+        first, *rest = t_batches
+        for b_id in rest:
+            parent[find(b_id)] = find(first)
+
+    groups = {}
+    for b_id in batch_ids:
+        groups.setdefault(find(b_id), []).append(b_id)
+    return sorted(groups.values(), key=len, reverse=True), shared_teachers
+
+
+def _quota_split(units, weights):
+    """Deals `units` (a list) out to weighted groups, keeping each group's share proportional at every step."""
+    total_weight = sum(weights.values())
+    shares = {g: [] for g in weights}
+    for k, unit in enumerate(units, start=1):
+        group = max(weights, key=lambda g: (weights[g] * k / total_weight - len(shares[g]), -g))
+        shares[group].append(unit)
+    return shares
+
+
+def _shared_teacher_shares(problem, batch_ids, groups, shared_teachers):
+    """Gives every group a disjoint share of each shared teacher's free slots and weekly room.
+
+    Shares are proportional to the group's demand on the teacher's subjects.
+    Returns, per group index, the `unavailable` masks and capped teacher rows
+    to overlay on that group's problem.
+    """
+    occupancy = Occupancy(problem, batch_ids)
+    qualified = build_subject_index(problem['teacher_subjects'])
+    group_of = {b_id: g for g, group in enumerate(groups) for b_id in group}
+    teachers = {row['teacher_id']: row for row in problem['teachers']}
+    weights = {t_id: {} for t_id in shared_teachers}
+    for item in problem['batch_subjects']:
+        g = group_of.get(item['batch_id'])
+        if g is None:
+            continue
+        for t_id in qualified.get(item['subject_id'], ()):
+            if t_id in weights:
+                share = item['classes_per_week'] / len(qualified[item['subject_id']])
+                weights[t_id][g] = weights[t_id].get(g, 0) + share
+
+    overlays = [{'unavailable': {}, 'teachers': {}} for _ in groups]
+    for t_id, group_weights in weights.items():
+        if not group_weights:
+            continue
+        free_slots = list(iter_slots(TEACHING_MASK & ~occupancy.teacher_busy.get(t_id, 0)))
+        slot_shares = _quota_split(free_slots, group_weights)
+        room = occupancy.teacher_room(t_id)
+        room_shares = _quota_split(list(range(max(room, 0))), group_weights) if room is not None else None
+        for g in group_weights:
+            own = sum(1 << slot_index for slot_index in slot_shares[g])
+            overlays[g]['unavailable'][t_id] = TEACHING_MASK & ~own
+            if room_shares is not None and t_id in teachers:
+                overlays[g]['teachers'][t_id] = dict(
+                    teachers[t_id], max_classes_per_week=occupancy.teacher_load.get(t_id, 0) + len(room_shares[g])
+                )
+    return overlays
+
+
+def _run_partition(args):
+    component, overlay, seed = args
+    problem, _, mode, time_budget = _worker_problem
+    group_problem = dict(problem, unavailable=overlay['unavailable'], teachers=[
+        overlay['teachers'].get(row['teacher_id'], row) for row in problem['teachers']
+    ])
+    return schedule(group_problem, component, mode=mode, rng=random.Random(seed), time_budget=time_budget)
+
+
+def schedule_partitioned(problem, batch_ids, mode='search', seed=None, time_budget=DEFAULT_TIME_BUDGET,
+                         workers=None, progress=None):
+    """Schedules independent batch groups in parallel processes and merges them.
+
+    Cross-department teachers are time-shared: each group only sees its share
+    of their free slots and weekly room (see _shared_teacher_shares), so group
+    results merge without clashes. The merge still checks every placement,
+    and a final search over the merged occupancy re-places any clash plus the
+    classes a group could not fit, now that the other groups' unused shares
+    are free. The result is shaped like schedule_best's, plus the number of
+    `groups` and of `reassigned` classes; its `timings` cover the whole run.
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 31) if mode == 'random' else 0
+    started = time.perf_counter()
+    groups, shared_teachers = partition_batches(problem, batch_ids)
+    if len(groups) <= 1:
+        return schedule_best(problem, batch_ids, 1, mode=mode, seed=seed, time_budget=time_budget, progress=progress)
+
+    total = len(expand_workload(item for item in problem['batch_subjects'] if item['batch_id'] in set(batch_ids)))
+    overlays = _shared_teacher_shares(problem, batch_ids, groups, shared_teachers)
+    workers = min(len(groups), workers or os.cpu_count() or 1)
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_attempt_worker,
+                             initargs=(problem, batch_ids, mode, time_budget)) as pool:
+        futures = [pool.submit(_run_partition, (group, overlay, seed)) for group, overlay in zip(groups, overlays)]
+        placed = 0
+        for future in as_completed(futures):
+            placed += future.result()['placed']
+            if progress:
+                progress(placed, total)
+        results = [future.result() for future in futures]
+
+    # Merge group by group; anything that clashes with what is already kept is re-placed.
+    occupancy = Occupancy(problem, batch_ids)
+    placements, failures, retry = [], [], {}
+    for result in results:
+        for failure in result['failures']:
+            if failure['reason'] == 'No qualified teachers':
+                failures.append(failure)
+            else:
+                key = (failure['batch_id'], failure['subject_id'])
+                retry[key] = retry.get(key, 0) + 1
+        for b_id, s_id, t_id, day, period in result['placements']:
+            slot_index = SLOT_INDEX[(day, period)]
+            bit = 1 << slot_index
+            if occupancy.teacher_free_mask(t_id, bit) and occupancy.free_mask(b_id, s_id) & bit:
+                occupancy.place(b_id, s_id, t_id, slot_index)
+                placements.append((b_id, s_id, t_id, day, period))
+            else:
+                retry[(b_id, s_id)] = retry.get((b_id, s_id), 0) + 1
+
+    if retry:
+        kept = [{'batch_id': b_id, 'subject_id': s_id, 'teacher_id': t_id, 'day_of_week': day, 'period': period}
+                for b_id, s_id, t_id, day, period in placements]
+        repair_problem = dict(problem, commitments=problem['commitments'] + kept, batch_subjects=[
+            {'batch_id': b_id, 'subject_id': s_id, 'classes_per_week': count}
+            for (b_id, s_id), count in retry.items()
+        ])
+        repair = schedule(repair_problem, sorted({b_id for b_id, _ in retry}), mode='search',
+                          rng=random.Random(seed), time_budget=time_budget)
+        placements.extend(repair['placements'])
+        failures.extend(repair['failures'])
+
+    # Groups expand in parallel, so the slowest one is the expansion's share of the wall time.
+    expand = max(group_result['timings']['expand'] for group_result in results)
+    result = {'placements': placements, 'placed': len(placements), 'total': total, 'failures': failures,
+              'seed': seed, 'groups': len(groups), 'reassigned': sum(retry.values()),
+              'timings': {'expand': expand, 'place': time.perf_counter() - started - expand}}
+    result['score'] = score_schedule(problem, result, batch_ids)
+    if progress:
+        progress(result['placed'], total)
+    return result
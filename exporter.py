@@ -0,0 +1,140 @@
+"""Streaming bulk export of every timetable as NDJSON, CSV or iCalendar.
+
+Rows come from a server-side (named) cursor in EXPORT_FETCH_SIZE chunks and
+are turned into output lines by generators, so memory use does not grow with
+the number of batches. Exports are grouped either per batch or per teacher.
+"""
+import csv
+import datetime
+import io
+import json
+from itertools import groupby
+
+import db
+from engine import DAYS
+
+# --- CONFIGURATION ---
+EXPORT_FETCH_SIZE = 2000
+
+PERIOD_TIMES = {
+    1: "09:30-10:20", 2: "10:20-11:10", 3: "11:10-12:00 (LUNCH)",
+    4: "12:00-12:50", 5: "12:50-01:40"
+}
+# The same periods on a 24-hour clock, for calendar events.
+PERIOD_CLOCK = {
+    1: ((9, 30), (10, 20)), 2: ((10, 20), (11, 10)), 3: ((11, 10), (12, 0)),
+    4: ((12, 0), (12, 50)), 5: ((12, 50), (13, 40)),
+}
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+    'ics': ('text/calendar', 'ics'),
+}
+SCOPES = {
+    'batches': ('batch_id', 'batch_name'),
+    'teachers': ('teacher_id', 'teacher_name'),
+}
+CSV_COLUMNS = ['batch_id', 'batch_name', 'department', 'day_of_week', 'period', 'time',
+               'subject_id', 'subject_name', 'short_code', 'teacher_id', 'teacher_name']
+
+_EXPORT_SQL = """
+    SELECT t.batch_id, b.batch_name, b.department, t.day_of_week, t.period,
+           t.subject_id, s.subject_name, s.short_code, t.teacher_id, te.name AS teacher_name
+    FROM timetable t
+    JOIN batches b ON b.batch_id = t.batch_id
+    JOIN subjects s ON s.subject_id = t.subject_id
+    JOIN teachers te ON te.teacher_id = t.teacher_id
+    ORDER BY {group_column}, array_position(%s::text[], t.day_of_week), t.period;
+"""
+
+
+def iter_rows(scope='batches'):
+    """Yields every timetable row as a dict, ordered by the scope's owner, day and period."""
+    group_column = 't.' + SCOPES[scope][0]
+    with db.connection() as conn:
+        with conn.cursor(name='timetable_export') as cur:
+            cur.itersize = EXPORT_FETCH_SIZE
+            cur.execute(_EXPORT_SQL.format(group_column=group_column), (DAYS,))
+            columns = None
+            for row in cur:
+                if columns is None:
+                    columns = [col[0] for col in cur.description]
+                item = dict(zip(columns, row))
+                item['time'] = PERIOD_TIMES.get(item['period'])
+                yield item
+
+
+def ndjson_lines(rows, scope='batches'):
+    """One JSON document per batch (or teacher) with its timetable."""
+    id_column, name_column = SCOPES[scope]
+    for owner_id, group in groupby(rows, key=lambda row: row[id_column]):
+        group = list(group)
+        document = {id_column: owner_id, name_column: group[0][name_column]}
+        if scope == 'batches':
+            document['department'] = group[0]['department']
+        document['timetable'] = [
+            {k: v for k, v in row.items() if k not in document} for row in group
+        ]
+        yield json.dumps(document) + "\n"
+
+
+def csv_lines(rows, scope='batches'):
+    """A header line, then one line per timetable slot."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= 8192:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ics_escape(text):
+    return str(text).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def ics_lines(rows, scope='batches', term_start=None):
+    """A calendar with one weekly recurring event per timetable slot.
+
+    Events start in the week of `term_start` (default: the current week).
+    Times are floating local times, as the timetable itself has no time zone.
+    """
+    term_start = term_start or datetime.date.today()
+    week_start = term_start - datetime.timedelta(days=term_start.weekday())
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    yield "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//SIH Timetable//Export//EN\r\nCALSCALE:GREGORIAN\r\n"
+    for row in rows:
+        if row['day_of_week'] not in DAYS or row['period'] not in PERIOD_CLOCK:
+            continue
+        date = week_start + datetime.timedelta(days=DAYS.index(row['day_of_week']))
+        (start_h, start_m), (end_h, end_m) = PERIOD_CLOCK[row['period']]
+        start = datetime.datetime.combine(date, datetime.time(start_h, start_m))
+        end = datetime.datetime.combine(date, datetime.time(end_h, end_m))
+        if scope == 'batches':
+            summary = f"{row['subject_name']} ({row['teacher_name']})"
+        else:
+            summary = f"{row['subject_name']} - {row['batch_name']}"
+        yield (
+            "BEGIN:VEVENT\r\n"
+            f"UID:{scope}-{row[SCOPES[scope][0]]}-{row['day_of_week']}-{row['period']}-{row['batch_id']}@sih-timetable\r\n"
+            f"DTSTAMP:{stamp}\r\n"
+            f"DTSTART:{start:%Y%m%dT%H%M%S}\r\n"
+            f"DTEND:{end:%Y%m%dT%H%M%S}\r\n"
+            "RRULE:FREQ=WEEKLY\r\n"
+            f"SUMMARY:{_ics_escape(summary)}\r\n"
+            f"CATEGORIES:{_ics_escape(row[SCOPES[scope][1]])}\r\n"
+            "END:VEVENT\r\n"
+        )
+    yield "END:VCALENDAR\r\n"
+
+
+WRITERS = {'ndjson': ndjson_lines, 'csv': csv_lines, 'ics': ics_lines}
+
+
+def export(fmt, scope='batches', **options):
+    """Returns a generator of output chunks for the whole timetable in `fmt`."""
+    return WRITERS[fmt](iter_rows(scope), scope, **options)
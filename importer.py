@@ -0,0 +1,276 @@
+"""Bulk CSV import of teachers, subjects, batches and their link tables.
+
+An import is a set of CSV files, at most one per table in IMPORT_ORDER, each
+with a header row naming its columns (see TABLES). It runs in two phases:
+
+1. A streaming validation pass reads every file row by row, checks types and
+   ranges, duplicate ids and short codes, and that every id a link row points
+   at exists in the database or earlier in the same import. The cleaned rows
+   are buffered as COPY text, not as Python objects.
+2. If no row failed, each buffer is COPYed into a temporary staging table and
+   merged with one UPDATE and one INSERT per table, all in one transaction.
+
+Entity rows that carry an id update that row (only the columns the file has)
+or create it with that id; rows without an id are always inserted. Link rows are upserted by their pair. If
+any row fails validation, nothing is written and all errors are returned.
+"""
+import csv
+import io
+
+import cache
+from engine import DAYS, PERIODS_PER_DAY
+
+# --- CONFIGURATION ---
+MAX_REPORTED_ERRORS = 500
+TEACHING_PERIODS_PER_DAY = PERIODS_PER_DAY - 1  # minus the lunch break
+TEACHING_SLOTS_PER_WEEK = len(DAYS) * TEACHING_PERIODS_PER_DAY
+
+# table -> (key columns, [(column, type, required)])
+TABLES = {
+    'subjects': (('subject_id',), [
+        ('subject_id', int, False), ('subject_name', str, True), ('short_code', str, True),
+        ('classes_per_week', int, True), ('max_per_day', int, True),
+    ]),
+    'teachers': (('teacher_id',), [
+        ('teacher_id', int, False), ('name', str, True), ('subject_specialization', str, False),
+        ('email', str, False), ('max_classes_per_week', int, True),
+    ]),
+    'batches': (('batch_id',), [
+        ('batch_id', int, False), ('batch_name', str, True), ('department', str, True),
+        ('level', str, False),
+    ]),
+    'teacher_subjects': (('teacher_id', 'subject_id'), [
+        ('teacher_id', int, True), ('subject_id', int, True),
+    ]),
+    'batch_subjects': (('batch_id', 'subject_id'), [
+        ('batch_id', int, True), ('subject_id', int, True), ('classes_per_week', int, True),
+    ]),
+}
+IMPORT_ORDER = ['subjects', 'teachers', 'batches', 'teacher_subjects', 'batch_subjects']
+ENTITY_TABLES = ('subjects', 'teachers', 'batches')
+# Link column -> entity table whose ids it must reference.
+REFERENCES = {'teacher_id': 'teachers', 'subject_id': 'subjects', 'batch_id': 'batches'}
+
+
+class ImportErrors(Exception):
+    """Raised with the list of per-row problems when an import is rejected."""
+
+    def __init__(self, errors, truncated=False):
+        super().__init__(f"{len(errors)} row(s) failed validation")
+        self.errors = errors
+        self.truncated = truncated
+
+
+def _copy_value(value):
+    if value is None:
+        return r'\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class _Validator:
+    """Checks rows as they stream past and keeps the cleaned ones as COPY text."""
+
+    def __init__(self, cur):
+        self.errors = []
+        self.error_count = 0
+        self.known_ids = {}
+        for table in ENTITY_TABLES:
+            key = TABLES[table][0][0]
+            cur.execute(f"SELECT {key} FROM {table};")
+            self.known_ids[table] = {row[0] for row in cur.fetchall()}
+        cur.execute("SELECT subject_id, lower(short_code) FROM subjects;")
+        self.short_code_owner = {code: subject_id for subject_id, code in cur.fetchall()}
+        self.buffers = {}
+        self.columns = {}
+        self.counts = {}
+
+    def error(self, table, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'file': table, 'line': line, 'message': message})
+
+    def _parse(self, table, line, raw):
+        row = {}
+        ok = True
+        for column, kind, required in TABLES[table][1]:
+            text = (raw.get(column) or '').strip()
+            if not text:
+                if required:
+                    self.error(table, line, f"'{column}' is required")
+                    ok = False
+                row[column] = None
+                continue
+            if kind is int:
+                try:
+                    row[column] = int(text)
+                except ValueError:
+                    self.error(table, line, f"'{column}' must be an integer, got {text!r}")
+                    ok = False
+                    continue
+                if row[column] < 0:
+                    self.error(table, line, f"'{column}' must not be negative")
+                    ok = False
+            else:
+                row[column] = text
+        return row if ok else None
+
+    def _check_ranges(self, table, line, row):
+        ok = True
+        if 'classes_per_week' in row and row['classes_per_week'] is not None:
+            if not 1 <= row['classes_per_week'] <= TEACHING_SLOTS_PER_WEEK:
+                self.error(table, line, f"classes_per_week must be between 1 and {TEACHING_SLOTS_PER_WEEK}")
+                ok = False
+        if table == 'subjects' and row['max_per_day'] is not None:
+            if not 1 <= row['max_per_day'] <= TEACHING_PERIODS_PER_DAY:
+                self.error(table, line, f"max_per_day must be between 1 and {TEACHING_PERIODS_PER_DAY}")
+                ok = False
+        if table == 'teachers' and row['max_classes_per_week'] is not None:
+            if row['max_classes_per_week'] > TEACHING_SLOTS_PER_WEEK:
+                self.error(table, line, f"max_classes_per_week must be at most {TEACHING_SLOTS_PER_WEEK}")
+                ok = False
+        return ok
+
+    def _check_references(self, table, line, row, seen):
+        ok = True
+        key_columns = TABLES[table][0]
+        if table in ENTITY_TABLES:
+            row_id = row[key_columns[0]]
+            if row_id is not None:
+                if row_id in seen:
+                    self.error(table, line, f"duplicate {key_columns[0]} {row_id} (first on line {seen[row_id]})")
+                    ok = False
+                seen.setdefault(row_id, line)
+            if table == 'subjects':
+                code = row['short_code'].lower()
+                owner = self.short_code_owner.get(code)
+                if owner is not None and (row_id is None or owner != row_id):
+                    where = f"subject {owner}" if isinstance(owner, int) else owner
+                    self.error(table, line, f"short_code {row['short_code']!r} is already used by {where}")
+                    ok = False
+                else:
+                    self.short_code_owner[code] = row_id if row_id is not None else f"line {line}"
+        else:
+            for column in key_columns:
+                if row[column] not in self.known_ids[REFERENCES[column]]:
+                    self.error(table, line, f"unknown {column} {row[column]}")
+                    ok = False
+            pair = tuple(row[column] for column in key_columns)
+            if pair in seen:
+                self.error(table, line, f"duplicate {'/'.join(key_columns)} {pair} (first on line {seen[pair]})")
+                ok = False
+            seen.setdefault(pair, line)
+        return ok
+
+    def validate(self, table, stream):
+        """Validates one CSV file (a text stream) and buffers its clean rows.
+
+        Only the key columns and the columns in the file's header are
+        buffered, so optional columns a file leaves out are not overwritten.
+        """
+        key_columns, spec = TABLES[table]
+        reader = csv.DictReader(stream)
+        header = reader.fieldnames or []
+        missing = [column for column, _, required in spec if required and column not in header]
+        if missing:
+            self.error(table, 1, f"missing column(s): {', '.join(missing)}")
+            return
+        columns = self.columns[table] = [column for column, _, _ in spec
+                                         if column in key_columns or column in header]
+        buffer = self.buffers[table] = io.StringIO()
+        seen = {}
+        count = 0
+        for raw in reader:
+            line = reader.line_num
+            row = self._parse(table, line, raw)
+            if row is None:
+                continue
+            in_range = self._check_ranges(table, line, row)
+            if not self._check_references(table, line, row, seen) or not in_range:
+                continue
+            buffer.write('\t'.join(_copy_value(row[column]) for column in columns) + '\n')
+            count += 1
+        self.counts[table] = count
+        if table in ENTITY_TABLES:
+            # Later link files may point at ids created by this one.
+            self.known_ids[table].update(key for key in seen)
+
+
+def _merge(cur, table, buffer, columns):
+    """COPYs one table's clean rows into staging and merges them; returns (updated, inserted).
+
+    `columns` are the ones the rows carry; other columns of existing rows
+    are left alone, and new rows get their defaults.
+    """
+    key_columns = TABLES[table][0]
+    staging = f"import_{table}"
+    # CREATE TABLE AS copies the column types but not the NOT NULL key constraints.
+    cur.execute(f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {', '.join(columns)} FROM {table} WITH NO DATA;")
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {staging} ({', '.join(columns)}) FROM STDIN", buffer)
+
+    value_columns = [column for column in columns if column not in key_columns]
+    key_match = ' AND '.join(f"t.{column} = s.{column}" for column in key_columns)
+    updated = 0
+    if value_columns:
+        assignments = ', '.join(f"{column} = s.{column}" for column in value_columns)
+        cur.execute(f"UPDATE {table} t SET {assignments} FROM {staging} s WHERE {key_match};")
+        updated = cur.rowcount
+
+    if table in ENTITY_TABLES:
+        key = key_columns[0]
+        cur.execute(f"""
+            INSERT INTO {table} ({', '.join(columns)})
+            SELECT {', '.join('s.' + column for column in columns)} FROM {staging} s
+            WHERE s.{key} IS NOT NULL AND NOT EXISTS (SELECT 1 FROM {table} t WHERE {key_match});
+        """)
+        inserted = cur.rowcount
+        without_id = [column for column in columns if column != key]
+        cur.execute(f"""
+            INSERT INTO {table} ({', '.join(without_id)})
+            SELECT {', '.join('s.' + column for column in without_id)} FROM {staging} s WHERE s.{key} IS NULL;
+        """)
+        inserted += cur.rowcount
+        # Explicit ids bypass the sequence; move it past them.
+        cur.execute(f"""
+            SELECT setval(pg_get_serial_sequence('{table}', '{key}'), max({key}))
+            FROM {table} HAVING max({key}) IS NOT NULL AND pg_get_serial_sequence('{table}', '{key}') IS NOT NULL;
+        """)
+    else:
+        cur.execute(f"""
+            INSERT INTO {table} ({', '.join(columns)})
+            SELECT {', '.join('s.' + column for column in columns)} FROM {staging} s
+            WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE {key_match});
+        """)
+        inserted = cur.rowcount
+    return updated, inserted
+
+
+def import_csv(conn, files, dry_run=False):
+    """Validates and loads `files` ({table: text stream}) inside the caller's transaction.
+
+    Raises ImportErrors if any row is invalid, without writing anything.
+    Otherwise returns per-table counts; the caller commits (or, for
+    `dry_run`, the data is only validated).
+    """
+    unknown = sorted(set(files) - set(TABLES))
+    if unknown:
+        raise ImportErrors([{'file': name, 'line': None, 'message': "unknown table"} for name in unknown])
+
+    with conn.cursor() as cur:
+        validator = _Validator(cur)
+        for table in IMPORT_ORDER:
+            if table in files:
+                validator.validate(table, files[table])
+        if validator.error_count:
+            raise ImportErrors(validator.errors, truncated=validator.error_count > len(validator.errors))
+
+        summary = {table: {'rows': count} for table, count in validator.counts.items()}
+        if dry_run:
+            return summary
+        for table in IMPORT_ORDER:
+            if table in validator.buffers:
+                updated, inserted = _merge(cur, table, validator.buffers[table], validator.columns[table])
+                summary[table].update(updated=updated, inserted=inserted)
+        # Renamed teachers or subjects show up in cached timetables.
+        cache.bump_all(cur)
+    return summary
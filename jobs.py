@@ -0,0 +1,196 @@
+"""Background execution of scheduler runs.
+
+The admin routes submit a run and get a job id back immediately; the run
+itself happens on a small thread pool in the worker that accepted it. The
+job's state, progress and outcome live in the `scheduler_jobs` table
+(migration 7), so `/admin/jobs/<id>` can be answered by any worker, and the
+one-active-job-per-key rule holds across workers.
+
+Progress reports from the scheduler only touch the in-memory Job; a flusher
+thread writes them, with a heartbeat, every PROGRESS_FLUSH_SECONDS. An
+active job whose heartbeat is older than JOB_STALE_SECONDS belonged to a
+worker that died and is marked failed. The most recent MAX_FINISHED_JOBS
+finished jobs are kept.
+"""
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2.extras
+
+import db
+import migrations
+
+# --- CONFIGURATION ---
+MAX_WORKERS = int(os.environ.get('SCHEDULER_JOB_WORKERS', 2))
+MAX_FINISHED_JOBS = 100
+PROGRESS_FLUSH_SECONDS = 1.0
+JOB_STALE_SECONDS = 60
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = 'queued', 'running', 'succeeded', 'failed'
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+_JOB_SQL = """
+    SELECT job_id, kind, description, state, placed, total, failures, error, result,
+           extract(epoch FROM submitted_at)::float AS submitted_at,
+           extract(epoch FROM started_at)::float AS started_at,
+           extract(epoch FROM finished_at)::float AS finished_at
+    FROM scheduler_jobs WHERE job_id = %s;
+"""
+
+
+def _json(value):
+    return psycopg2.extras.Json(value, dumps=lambda obj: json.dumps(obj, default=str))
+
+
+class Job:
+    """The running side of one scheduler run: its id and latest progress."""
+
+    def __init__(self, kind, key, description):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.description = description
+        self.placed = 0
+        self.total = 0
+
+    def report_progress(self, placed, total):
+        """Progress callback handed to the scheduler functions."""
+        self.placed = placed
+        self.total = total
+
+
+def _to_dict(row):
+    job = dict(row)
+    now = time.time()
+    submitted, started, finished = job.pop('submitted_at'), job.pop('started_at'), job.pop('finished_at')
+    job['progress'] = {'placed': job.pop('placed'), 'total': job.pop('total')}
+    job['timings'] = {
+        'submitted_at': submitted,
+        'started_at': started,
+        'finished_at': finished,
+        'queued_seconds': round((started or now) - submitted, 3),
+        'run_seconds': round((finished or now) - started, 3) if started else None,
+    }
+    return job
+
+
+class JobManager:
+    """Runs submitted functions on a thread pool, one active job per key.
+
+    Submitting a job whose key matches one that is still queued or running,
+    in any worker, returns the existing job instead of starting a second
+    run, so two admins pressing "Generate" at once share one global
+    regeneration.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scheduler-job')
+        self._lock = threading.Lock()
+        self._local = {}  # job id -> Job, for the active jobs of this process
+        self._flusher = None
+
+    def submit(self, kind, key, description, fn):
+        """Queues `fn(job)`; returns (job_id, created) where created is False when coalesced."""
+        migrations.ensure_migrated()
+        job = Job(kind, key, description)
+        with db.connection() as conn, conn.cursor() as cur:
+            _expire_stale(cur)
+            while True:
+                cur.execute("""
+                    INSERT INTO scheduler_jobs (job_id, kind, key, description, state)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT (key) WHERE state IN ('queued', 'running') DO NOTHING
+                    RETURNING job_id;
+                """, (job.id, kind, key, description, QUEUED))
+                if cur.fetchone() is not None:
+                    break
+                cur.execute("SELECT job_id FROM scheduler_jobs WHERE key = %s AND state IN ('queued', 'running');",
+                            (key,))
+                active = cur.fetchone()
+                if active is not None:
+                    conn.commit()
+                    return active[0], False
+                # The active job finished in between; try again.
+            cur.execute("""
+                DELETE FROM scheduler_jobs WHERE state NOT IN ('queued', 'running') AND job_id NOT IN (
+                    SELECT job_id FROM scheduler_jobs WHERE state NOT IN ('queued', 'running')
+                    ORDER BY submitted_at DESC LIMIT %s
+                );
+            """, (MAX_FINISHED_JOBS,))
+            conn.commit()
+        with self._lock:
+            self._local[job.id] = job
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name='scheduler-job-flush', daemon=True)
+                self._flusher.start()
+        self._executor.submit(self._run, job, fn)
+        return job.id, True
+
+    def get(self, job_id):
+        """The job as a dict (state, progress, failures, error, result, timings), or None."""
+        with db.connection() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            _expire_stale(cur)
+            cur.execute(_JOB_SQL, (job_id,))
+            row = cur.fetchone()
+            conn.commit()
+        return _to_dict(row) if row else None
+
+    def _update(self, job_id, sql, params=()):
+        with db.connection() as conn, conn.cursor() as cur:
+            cur.execute(f"UPDATE scheduler_jobs SET {sql}, heartbeat_at = now() WHERE job_id = %s;",
+                        (*params, job_id))
+            conn.commit()
+
+    def _run(self, job, fn):
+        try:
+            self._update(job.id, "state = %s, started_at = now()", (RUNNING,))
+            result = fn(job) or {}
+            result = dict(result)
+            failures = result.pop('failures', [])
+            self._update(job.id, """
+                state = %s, finished_at = now(), placed = %s, total = %s, failures = %s, result = %s
+            """, (SUCCEEDED, result.get('placed', job.placed), result.get('total', job.total),
+                  _json(failures), _json(result)))
+        except Exception as e:
+            traceback.print_exc()
+            try:
+                self._update(job.id, "state = %s, finished_at = now(), error = %s, placed = %s, total = %s",
+                             (FAILED, str(e), job.placed, job.total))
+            except Exception:
+                traceback.print_exc()
+        finally:
+            with self._lock:
+                self._local.pop(job.id, None)
+
+    def _flush_loop(self):
+        """Writes the progress and heartbeat of this process's active jobs until it has none."""
+        while True:
+            time.sleep(PROGRESS_FLUSH_SECONDS)
+            with self._lock:
+                active = list(self._local.values())
+                if not active:
+                    self._flusher = None
+                    return
+            try:
+                with db.connection() as conn, conn.cursor() as cur:
+                    cur.execute("""
+                        UPDATE scheduler_jobs j SET placed = p.placed, total = p.total, heartbeat_at = now()
+                        FROM unnest(%s::text[], %s::int[], %s::int[]) AS p(job_id, placed, total)
+                        WHERE j.job_id = p.job_id AND j.state IN ('queued', 'running');
+                    """, ([job.id for job in active], [job.placed for job in active], [job.total for job in active]))
+                    conn.commit()
+            except Exception as e:
+                print(f"  - WARNING: Saving scheduler job progress failed: {e}")
+
+
+def _expire_stale(cur):
+    """Marks failed the active jobs of workers that stopped sending heartbeats."""
+    cur.execute("""
+        UPDATE scheduler_jobs SET state = %s, finished_at = now(), error = 'The worker running this job stopped.'
+        WHERE state IN ('queued', 'running') AND heartbeat_at < now() - make_interval(secs => %s);
+    """, (FAILED, JOB_STALE_SECONDS))
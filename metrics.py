@@ -0,0 +1,299 @@
+"""In-process metrics in the Prometheus text format, plus opt-in scheduler profiling.
+
+Counters and histograms live in this worker's memory (each gunicorn worker
+keeps and serves its own, like the timetable cache), and `/metrics` renders
+them with `render()`. Three sources feed them:
+
+* the app's request hooks time every route (`start_request` / `finish_request`);
+* pooled connections are made with TimedConnection, whose cursors count and
+  time every statement against the route that ran it, or '(background)' for
+  scheduler jobs;
+* scheduler runs report per-phase durations and placed/failed classes.
+
+`profiled(fn)` wraps a scheduler job so that one run executes under cProfile
+and its stats are saved under PROFILE_DIR for download. cProfile only sees
+its own process, so profiled runs must not hand work to a process pool (the
+app turns partitioning off for them).
+"""
+import contextvars
+import cProfile
+import io
+import os
+import pstats
+import tempfile
+import threading
+import time
+
+import psycopg2.extensions
+
+# --- CONFIGURATION ---
+# Bearer token Prometheus sends to scrape /metrics; without it a logged-in admin session is needed.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+PROFILE_DIR = os.environ.get('SCHEDULER_PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'timetable-profiles')
+PROFILE_TOP_FUNCTIONS = 60
+PROFILE_SORT_KEYS = sorted(key.value for key in pstats.SortKey)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+PHASE_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+BACKGROUND = '(background)'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing value per label combination."""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, _label_text(self.labels, key), value
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label combination."""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+        for key, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield self.name + '_bucket', _label_text(self.labels, key, [('le', _number(bound))]), cumulative
+            yield self.name + '_sum', _label_text(self.labels, key), series[-2]
+            yield self.name + '_count', _label_text(self.labels, key), series[-1]
+
+
+# --- REGISTRY ---
+_metrics = []
+_collectors = []
+
+
+def _register(metric):
+    _metrics.append(metric)
+    return metric
+
+
+def register_collector(collect):
+    """Adds a callable returning [(name, help, type, [(labels dict, value), ...])] read at scrape time."""
+    _collectors.append(collect)
+
+
+HTTP_REQUEST_SECONDS = _register(Histogram(
+    'http_request_duration_seconds', "Time to build a response, per route.", ('method', 'route', 'status')))
+HTTP_REQUEST_QUERIES = _register(Histogram(
+    'http_request_db_queries', "Database statements run while building a response, per route.", ('route',),
+    QUERY_COUNT_BUCKETS))
+HTTP_REQUEST_DB_SECONDS = _register(Histogram(
+    'http_request_db_seconds', "Time spent in database statements per request, per route.", ('route',)))
+DB_QUERIES = _register(Counter('db_queries_total', "Database statements run.", ('route',)))
+DB_QUERY_SECONDS = _register(Counter('db_query_seconds_total', "Time spent in database statements.", ('route',)))
+SCHEDULER_PHASE_SECONDS = _register(Histogram(
+    'scheduler_phase_seconds', "Duration of each scheduler run phase.", ('kind', 'phase'), PHASE_BUCKETS))
+SCHEDULER_RUNS = _register(Counter('scheduler_runs_total', "Finished scheduler runs.", ('kind',)))
+SCHEDULER_CLASSES_PLACED = _register(Counter(
+    'scheduler_classes_placed_total', "Classes placed by scheduler runs.", ('kind',)))
+SCHEDULER_CLASSES_FAILED = _register(Counter(
+    'scheduler_classes_failed_total', "Classes scheduler runs could not place.", ('kind', 'reason')))
+
+
+def render():
+    """Every metric and collector in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(f"{name}{labels} {_number(value)}" for name, labels, value in metric.samples())
+    for collect in _collectors:
+        for name, help_text, kind, samples in collect():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_label_text(list(labels), list(labels.values()))} {_number(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+# --- REQUEST TRACKING ---
+# The route whose statements the current context's cursors are counting against.
+_current_request = contextvars.ContextVar('metrics_request', default=None)
+
+
+def start_request(route):
+    """Starts timing a request; returns the state `finish_request` needs."""
+    state = {'route': route, 'queries': 0, 'db_seconds': 0.0, 'started': time.perf_counter()}
+    state['token'] = _current_request.set(state)
+    return state
+
+
+def finish_request(state, method, status):
+    elapsed = time.perf_counter() - state['started']
+    _current_request.reset(state['token'])
+    HTTP_REQUEST_SECONDS.observe(elapsed, method=method, route=state['route'], status=status)
+    HTTP_REQUEST_QUERIES.observe(state['queries'], route=state['route'])
+    HTTP_REQUEST_DB_SECONDS.observe(state['db_seconds'], route=state['route'])
+
+
+def record_query(seconds):
+    state = _current_request.get()
+    route = state['route'] if state else BACKGROUND
+    if state:
+        state['queries'] += 1
+        state['db_seconds'] += seconds
+    DB_QUERIES.inc(route=route)
+    DB_QUERY_SECONDS.inc(seconds, route=route)
+
+
+# --- DATABASE INSTRUMENTATION ---
+class _TimedCursorMixin:
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query(time.perf_counter() - started)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            record_query(time.perf_counter() - started)
+
+
+_timed_cursor_classes = {}
+
+
+def _timed_cursor_class(base):
+    timed = _timed_cursor_classes.get(base)
+    if timed is None:
+        timed = _timed_cursor_classes[base] = type('Timed' + base.__name__, (_TimedCursorMixin, base), {})
+    return timed
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    """A connection whose cursors, whatever their cursor_factory, report every statement to record_query."""
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _timed_cursor_class(base)
+        return super().cursor(*args, **kwargs)
+
+
+# --- SCHEDULER ---
+def record_scheduler_run(kind, phases, placed, failures):
+    """Records one run's phase durations ({phase: seconds}) and outcome."""
+    for phase, seconds in phases.items():
+        SCHEDULER_PHASE_SECONDS.observe(seconds, kind=kind, phase=phase)
+    SCHEDULER_RUNS.inc(kind=kind)
+    SCHEDULER_CLASSES_PLACED.inc(placed, kind=kind)
+    for failure in failures:
+        SCHEDULER_CLASSES_FAILED.inc(kind=kind, reason=failure['reason'])
+
+
+# --- PROFILING ---
+# cProfile cannot profile two threads' runs into one file, so one profiled run at a time.
+_profile_lock = threading.Lock()
+
+
+def profile_path(job_id):
+    return os.path.join(PROFILE_DIR, f"{job_id}.prof")
+
+
+def profiled(fn):
+    """Wraps a job function so its run executes under cProfile.
+
+    The stats are saved to profile_path(job.id) and the job's result gains a
+    `profile` entry. If another profiled run is active, this one runs
+    unprofiled and says so in the result.
+    """
+    def run(job):
+        if not _profile_lock.acquire(blocking=False):
+            result = fn(job)
+            if isinstance(result, dict):
+                result['profile'] = {'saved': False, 'reason': "Another profiled run was active."}
+            return result
+        try:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                result = fn(job)
+            finally:
+                profiler.disable()
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                profiler.dump_stats(profile_path(job.id))
+        finally:
+            _profile_lock.release()
+        if isinstance(result, dict):
+            result['profile'] = {'saved': True, 'url': f"/admin/jobs/{job.id}/profile"}
+        return result
+    return run
+
+
+def profile_text(job_id, sort='cumulative', limit=PROFILE_TOP_FUNCTIONS):
+    """The saved profile of a job as a pstats report of its top functions.
+
+    Raises ValueError unless `sort` is one of PROFILE_SORT_KEYS.
+    """
+    if sort not in PROFILE_SORT_KEYS:
+        raise ValueError(f"sort must be one of {', '.join(PROFILE_SORT_KEYS)}")
+    out = io.StringIO()
+    stats = pstats.Stats(profile_path(job_id), stream=out)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return out.getvalue()
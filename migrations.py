@@ -0,0 +1,517 @@
+"""Versioned schema migrations.
+
+MIGRATIONS is an append-only list of (version, name, sql). `migrate()` applies
+the ones missing from `schema_migrations`, in order and in one transaction,
+under an advisory lock so concurrent workers do not race. The app calls
+`ensure_migrated()` lazily, once per process; it can also be run by hand:
+
+    python migrations.py                 # apply pending migrations
+    python migrations.py --status        # list applied and pending versions
+    python migrations.py --check-plans   # EXPLAIN the hot queries, fail on full scans
+
+Every statement is idempotent (IF NOT EXISTS / OR REPLACE), so the first
+migration also adopts a database that was created by hand before migrations
+existed. Never edit a migration that has shipped; add a new one.
+
+A migration that must delete rows first (CLEANUPS) is never applied by the
+app: it refuses to serve until `python migrations.py` has run it and
+printed what it deleted.
+"""
+import argparse
+import json
+import sys
+import threading
+
+import db
+
+MIGRATIONS_LOCK_KEY = 7_304_114
+
+MIGRATIONS = [
+    (1, 'base schema', """
+        CREATE TABLE IF NOT EXISTS admin (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(50) NOT NULL UNIQUE,
+            password VARCHAR(255) NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS teachers (
+            teacher_id SERIAL PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            subject_specialization VARCHAR(100),
+            email VARCHAR(100),
+            max_classes_per_week INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS subjects (
+            subject_id SERIAL PRIMARY KEY,
+            subject_name VARCHAR(100) NOT NULL,
+            short_code VARCHAR(20),
+            classes_per_week INTEGER NOT NULL,
+            max_per_day INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS batches (
+            batch_id SERIAL PRIMARY KEY,
+            batch_name VARCHAR(100) NOT NULL,
+            department VARCHAR(100),
+            level VARCHAR(50)
+        );
+        CREATE TABLE IF NOT EXISTS teacher_subjects (
+            teacher_id INTEGER NOT NULL REFERENCES teachers (teacher_id),
+            subject_id INTEGER NOT NULL REFERENCES subjects (subject_id)
+        );
+        CREATE TABLE IF NOT EXISTS batch_subjects (
+            batch_id INTEGER NOT NULL REFERENCES batches (batch_id),
+            subject_id INTEGER NOT NULL REFERENCES subjects (subject_id),
+            classes_per_week INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS timetable (
+            timetable_id SERIAL PRIMARY KEY,
+            batch_id INTEGER NOT NULL REFERENCES batches (batch_id),
+            subject_id INTEGER NOT NULL REFERENCES subjects (subject_id),
+            teacher_id INTEGER NOT NULL REFERENCES teachers (teacher_id),
+            day_of_week VARCHAR(10) NOT NULL,
+            period INTEGER NOT NULL
+        );
+    """),
+    (2, 'timetable and link table indexes, unique slots', """
+        -- Duplicates are removed first by CLEANUPS[2], see migrate().
+        -- Covers get_timetable and update_slot: the batch's slots without a heap visit.
+        CREATE UNIQUE INDEX IF NOT EXISTS timetable_batch_slot_key
+            ON timetable (batch_id, day_of_week, period) INCLUDE (subject_id, teacher_id);
+        CREATE UNIQUE INDEX IF NOT EXISTS timetable_teacher_slot_key
+            ON timetable (teacher_id, day_of_week, period) INCLUDE (batch_id, subject_id);
+        CREATE INDEX IF NOT EXISTS timetable_subject_idx ON timetable (subject_id);
+        CREATE UNIQUE INDEX IF NOT EXISTS teacher_subjects_key ON teacher_subjects (teacher_id, subject_id);
+        CREATE INDEX IF NOT EXISTS teacher_subjects_subject_idx ON teacher_subjects (subject_id);
+        CREATE UNIQUE INDEX IF NOT EXISTS batch_subjects_key
+            ON batch_subjects (batch_id, subject_id) INCLUDE (classes_per_week);
+        CREATE INDEX IF NOT EXISTS batch_subjects_subject_idx ON batch_subjects (subject_id);
+    """),
+    (3, 'timetable cache versions', """
+        CREATE TABLE IF NOT EXISTS timetable_versions (
+            batch_id INTEGER PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0
+        );
+    """),
+    (4, 'admin change log', """
+        -- txid is the writing transaction's id, which orders changes against reader snapshots.
+        CREATE TABLE IF NOT EXISTS admin_changes (
+            change_id BIGSERIAL PRIMARY KEY,
+            table_name TEXT NOT NULL,
+            row_key JSONB NOT NULL,
+            changed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            txid BIGINT NOT NULL DEFAULT pg_current_xact_id()::text::bigint
+        );
+        CREATE INDEX IF NOT EXISTS admin_changes_txid_idx ON admin_changes (txid);
+        CREATE INDEX IF NOT EXISTS admin_changes_changed_at_idx ON admin_changes (changed_at);
+        -- The highest txid pruned from the log; older versions need a full snapshot.
+        CREATE TABLE IF NOT EXISTS admin_changes_horizon (
+            singleton BOOLEAN PRIMARY KEY DEFAULT true CHECK (singleton),
+            pruned_through BIGINT NOT NULL DEFAULT 0
+        );
+        INSERT INTO admin_changes_horizon (singleton) VALUES (true) ON CONFLICT DO NOTHING;
+
+        CREATE OR REPLACE FUNCTION log_admin_change() RETURNS trigger AS $$
+        DECLARE
+            col TEXT;
+            old_key JSONB := '{}';
+            new_key JSONB := '{}';
+        BEGIN
+            FOREACH col IN ARRAY TG_ARGV LOOP
+                IF TG_OP <> 'INSERT' THEN
+                    old_key := old_key || jsonb_build_object(col, to_jsonb(OLD) -> col);
+                END IF;
+                IF TG_OP <> 'DELETE' THEN
+                    new_key := new_key || jsonb_build_object(col, to_jsonb(NEW) -> col);
+                END IF;
+            END LOOP;
+            IF TG_OP <> 'INSERT' THEN
+                INSERT INTO admin_changes (table_name, row_key) VALUES (TG_TABLE_NAME, old_key);
+            END IF;
+            IF TG_OP <> 'DELETE' AND new_key IS DISTINCT FROM old_key THEN
+                INSERT INTO admin_changes (table_name, row_key) VALUES (TG_TABLE_NAME, new_key);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS teachers_log_admin_change ON teachers;
+        CREATE TRIGGER teachers_log_admin_change AFTER INSERT OR UPDATE OR DELETE ON teachers
+            FOR EACH ROW EXECUTE FUNCTION log_admin_change('teacher_id');
+        DROP TRIGGER IF EXISTS subjects_log_admin_change ON subjects;
+        CREATE TRIGGER subjects_log_admin_change AFTER INSERT OR UPDATE OR DELETE ON subjects
+            FOR EACH ROW EXECUTE FUNCTION log_admin_change('subject_id');
+        DROP TRIGGER IF EXISTS batches_log_admin_change ON batches;
+        CREATE TRIGGER batches_log_admin_change AFTER INSERT OR UPDATE OR DELETE ON batches
+            FOR EACH ROW EXECUTE FUNCTION log_admin_change('batch_id');
+        DROP TRIGGER IF EXISTS teacher_subjects_log_admin_change ON teacher_subjects;
+        CREATE TRIGGER teacher_subjects_log_admin_change AFTER INSERT OR UPDATE OR DELETE ON teacher_subjects
+            FOR EACH ROW EXECUTE FUNCTION log_admin_change('teacher_id', 'subject_id');
+        DROP TRIGGER IF EXISTS batch_subjects_log_admin_change ON batch_subjects;
+        CREATE TRIGGER batch_subjects_log_admin_change AFTER INSERT OR UPDATE OR DELETE ON batch_subjects
+            FOR EACH ROW EXECUTE FUNCTION log_admin_change('batch_id', 'subject_id');
+
+        -- Drops changes older than the retention (the trigger's argument), at most once per
+        -- writing transaction. A writer that cannot get the lock at once leaves it to the holder.
+        CREATE OR REPLACE FUNCTION prune_admin_changes() RETURNS trigger AS $$
+        BEGIN
+            IF current_setting('admin_changes.pruned', true) IS DISTINCT FROM 'on'
+               AND pg_try_advisory_xact_lock(7304113) THEN
+                PERFORM set_config('admin_changes.pruned', 'on', true);
+                WITH gone AS (
+                    DELETE FROM admin_changes WHERE changed_at < now() - TG_ARGV[0]::interval RETURNING txid
+                )
+                UPDATE admin_changes_horizon SET pruned_through = greatest(pruned_through, g.txid)
+                FROM (SELECT max(txid) AS txid FROM gone) g WHERE g.txid IS NOT NULL;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS admin_changes_prune ON admin_changes;
+        CREATE TRIGGER admin_changes_prune AFTER INSERT ON admin_changes
+            FOR EACH STATEMENT EXECUTE FUNCTION prune_admin_changes('7 days');
+    """),
+    (5, 'timetable snapshots', """
+        CREATE TABLE IF NOT EXISTS timetable_snapshots (
+            snapshot_id BIGSERIAL PRIMARY KEY,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            kind TEXT NOT NULL,
+            description TEXT NOT NULL DEFAULT '',
+            batch_count INTEGER NOT NULL DEFAULT 0,
+            class_count INTEGER NOT NULL DEFAULT 0,
+            -- NULL for a full snapshot; for a delta, the full snapshot its chain starts at.
+            base_id BIGINT,
+            depth INTEGER NOT NULL DEFAULT 0
+        );
+        -- One packed array per batch; see snapshots.py for the encoding.
+        CREATE TABLE IF NOT EXISTS timetable_snapshot_batches (
+            snapshot_id BIGINT NOT NULL REFERENCES timetable_snapshots (snapshot_id) ON DELETE CASCADE,
+            batch_id INTEGER NOT NULL,
+            slots BIGINT[] NOT NULL,
+            PRIMARY KEY (snapshot_id, batch_id)
+        );
+        -- Resolves one batch of a delta from its chain.
+        CREATE INDEX IF NOT EXISTS timetable_snapshot_batches_batch_idx
+            ON timetable_snapshot_batches (batch_id, snapshot_id);
+    """),
+    (6, 'teacher lookup views', """
+        -- See teacher_views.py: every class a teacher teaches, with the names denormalized.
+        CREATE MATERIALIZED VIEW IF NOT EXISTS teacher_timetable_mv AS
+            SELECT t.teacher_id,
+                   (array_position(ARRAY['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday'], t.day_of_week) - 1) * 5
+                       + t.period - 1 AS slot,
+                   t.day_of_week, t.period, t.batch_id, b.batch_name, b.department,
+                   t.subject_id, s.subject_name, s.short_code
+            FROM timetable t
+            JOIN batches b ON b.batch_id = t.batch_id
+            JOIN subjects s ON s.subject_id = t.subject_id;
+        CREATE UNIQUE INDEX IF NOT EXISTS teacher_timetable_mv_key ON teacher_timetable_mv (teacher_id, slot, batch_id);
+
+        -- One row per qualified subject for every teaching slot (lunch excluded) a teacher has free.
+        CREATE MATERIALIZED VIEW IF NOT EXISTS teacher_free_slots_mv AS
+            SELECT d.day_of_week, p.period, ts.subject_id, te.teacher_id, te.name,
+                   coalesce(l.classes, 0) AS weekly_load, te.max_classes_per_week
+            FROM teachers te
+            JOIN teacher_subjects ts ON ts.teacher_id = te.teacher_id
+            CROSS JOIN unnest(ARRAY['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']) AS d(day_of_week)
+            CROSS JOIN generate_series(1, 5) AS p(period)
+            LEFT JOIN (SELECT teacher_id, count(*) AS classes FROM timetable GROUP BY teacher_id) l
+                ON l.teacher_id = te.teacher_id
+            WHERE p.period <> 3
+              AND NOT EXISTS (SELECT 1 FROM timetable t WHERE t.teacher_id = te.teacher_id
+                              AND t.day_of_week = d.day_of_week AND t.period = p.period);
+        CREATE UNIQUE INDEX IF NOT EXISTS teacher_free_slots_mv_key
+            ON teacher_free_slots_mv (day_of_week, period, subject_id, teacher_id);
+
+        -- One row per statement that changed something the views read, committed with it;
+        -- refresh() deletes the rows it catches up with. Writers only ever insert here, so
+        -- they never wait on each other or on a refresh.
+        CREATE TABLE IF NOT EXISTS teacher_views_changes (
+            change_id BIGSERIAL PRIMARY KEY,
+            changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+
+        CREATE OR REPLACE FUNCTION note_teacher_views_change() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO teacher_views_changes DEFAULT VALUES;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS timetable_note_teacher_views_change ON timetable;
+        CREATE TRIGGER timetable_note_teacher_views_change AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON timetable
+            FOR EACH STATEMENT EXECUTE FUNCTION note_teacher_views_change();
+        DROP TRIGGER IF EXISTS teachers_note_teacher_views_change ON teachers;
+        CREATE TRIGGER teachers_note_teacher_views_change AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON teachers
+            FOR EACH STATEMENT EXECUTE FUNCTION note_teacher_views_change();
+        DROP TRIGGER IF EXISTS subjects_note_teacher_views_change ON subjects;
+        CREATE TRIGGER subjects_note_teacher_views_change AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON subjects
+            FOR EACH STATEMENT EXECUTE FUNCTION note_teacher_views_change();
+        DROP TRIGGER IF EXISTS batches_note_teacher_views_change ON batches;
+        CREATE TRIGGER batches_note_teacher_views_change AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON batches
+            FOR EACH STATEMENT EXECUTE FUNCTION note_teacher_views_change();
+        DROP TRIGGER IF EXISTS teacher_subjects_note_teacher_views_change ON teacher_subjects;
+        CREATE TRIGGER teacher_subjects_note_teacher_views_change AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON teacher_subjects
+            FOR EACH STATEMENT EXECUTE FUNCTION note_teacher_views_change();
+    """),
+    (7, 'scheduler jobs', """
+        -- See jobs.py. Any worker can answer a poll; at most one active job per key.
+        CREATE TABLE IF NOT EXISTS scheduler_jobs (
+            job_id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            description TEXT NOT NULL,
+            state TEXT NOT NULL,
+            placed INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            failures JSONB NOT NULL DEFAULT '[]',
+            result JSONB,
+            error TEXT,
+            submitted_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            started_at TIMESTAMPTZ,
+            finished_at TIMESTAMPTZ,
+            heartbeat_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS scheduler_jobs_active_key
+            ON scheduler_jobs (key) WHERE state IN ('queued', 'running');
+        CREATE INDEX IF NOT EXISTS scheduler_jobs_submitted_idx ON scheduler_jobs (submitted_at);
+    """),
+]
+
+# version -> [(what, DELETE statement)] run just before that migration. Each
+# deletes rows in the way of its constraints, so they are never run
+# implicitly: migrate() refuses until they are allowed (`python migrations.py`)
+# if any of them would delete something.
+CLEANUPS = {
+    2: [
+        # Keep the oldest row of any double-booked batch or teacher slot, and
+        # of any duplicated link, so the unique indexes can be built.
+        ('double-booked batch slots', """
+            DELETE FROM timetable a USING timetable b
+            WHERE a.batch_id = b.batch_id AND a.day_of_week = b.day_of_week AND a.period = b.period
+              AND a.timetable_id > b.timetable_id;
+        """),
+        ('double-booked teacher slots', """
+            DELETE FROM timetable a USING timetable b
+            WHERE a.teacher_id = b.teacher_id AND a.day_of_week = b.day_of_week AND a.period = b.period
+              AND a.timetable_id > b.timetable_id;
+        """),
+        ('duplicate teacher_subjects links', """
+            DELETE FROM teacher_subjects a USING teacher_subjects b
+            WHERE a.teacher_id = b.teacher_id AND a.subject_id = b.subject_id AND a.ctid > b.ctid;
+        """),
+        ('duplicate batch_subjects links', """
+            DELETE FROM batch_subjects a USING batch_subjects b
+            WHERE a.batch_id = b.batch_id AND a.subject_id = b.subject_id AND a.ctid > b.ctid;
+        """),
+    ],
+}
+
+
+class CleanupRequired(Exception):
+    """Raised when a pending migration would delete rows and cleanups were not allowed."""
+
+    def __init__(self, version, counts):
+        found = ', '.join(f"{count} {what}" for what, count in counts.items())
+        super().__init__(f"Migration {version} has to delete rows first ({found}); "
+                         f"run `python migrations.py` to apply it.")
+        self.version = version
+        self.counts = counts
+
+
+_migrated = False
+_migrate_lock = threading.Lock()
+
+
+def applied_versions(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+    cur.execute("SELECT version FROM schema_migrations;")
+    return {row[0] for row in cur.fetchall()}
+
+
+def _run_cleanups(cur, version, allow_cleanups):
+    """Runs CLEANUPS[version]; returns {what: rows deleted} for the ones that deleted any.
+
+    Without `allow_cleanups`, raises CleanupRequired (the caller rolls back)
+    if any of them deleted rows.
+    """
+    counts = {}
+    for what, sql in CLEANUPS.get(version, []):
+        cur.execute(sql)
+        if cur.rowcount:
+            counts[what] = cur.rowcount
+    if counts and not allow_cleanups:
+        raise CleanupRequired(version, counts)
+    return counts
+
+
+def migrate(conn, allow_cleanups=False):
+    """Applies every pending migration in one transaction.
+
+    Returns (versions applied, {version: {what: rows deleted}}). Unless
+    `allow_cleanups`, raises CleanupRequired and applies nothing if a
+    migration would first have to delete rows (see CLEANUPS).
+    """
+    cleaned = {}
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATIONS_LOCK_KEY,))
+            done = applied_versions(cur)
+            applied = []
+            for version, name, sql in MIGRATIONS:
+                if version in done:
+                    continue
+                counts = _run_cleanups(cur, version, allow_cleanups)
+                if counts:
+                    cleaned[version] = counts
+                cur.execute(sql)
+                cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s);", (version, name))
+                applied.append(version)
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    return applied, cleaned
+
+
+def ensure_migrated():
+    """Brings the schema up to date on first use in this process."""
+    global _migrated
+    if _migrated:
+        return
+    with _migrate_lock:
+        if not _migrated:
+            with db.connection() as conn:
+                migrate(conn)
+            _migrated = True
+
+
+# --- QUERY PLAN CHECK ---
+# The per-request and per-edit queries, which must never scan a whole table.
+# Full reads of `timetable` by the scheduler itself are expected and not listed.
+HOT_QUERIES = [
+    ('get_timetable', """
+        SELECT t.day_of_week, t.period, s.subject_name, s.subject_id, te.name AS teacher_name, t.teacher_id
+        FROM timetable t
+        JOIN subjects s ON t.subject_id = s.subject_id
+        JOIN teachers te ON t.teacher_id = te.teacher_id
+        WHERE t.batch_id = 1 ORDER BY t.day_of_week, t.period;
+    """),
+    ('update_slot conflict target', """
+        SELECT timetable_id FROM timetable WHERE batch_id = 1 AND day_of_week = 'Monday' AND period = 1;
+    """),
+    ('teacher slot clash', """
+        SELECT batch_id FROM timetable WHERE teacher_id = 1 AND day_of_week = 'Monday' AND period = 1;
+    """),
+    ('schedule_single_batch delete', "DELETE FROM timetable WHERE batch_id = 1;"),
+    ('delete_teacher slots', "DELETE FROM timetable WHERE teacher_id = 1;"),
+    ('rows showing a teacher or subject', "SELECT DISTINCT batch_id FROM timetable WHERE teacher_id = 1 OR subject_id = 1;"),
+    ('load batch_subjects', "SELECT * FROM batch_subjects WHERE batch_id = ANY(ARRAY[1, 2]);"),
+    ('batch_subjects of a subject', "SELECT batch_id FROM batch_subjects WHERE subject_id = ANY(ARRAY[1, 2]);"),
+    ('teacher_subjects of a teacher', "DELETE FROM teacher_subjects WHERE teacher_id = 1;"),
+    ('teacher_subjects of a subject', "SELECT teacher_id FROM teacher_subjects WHERE subject_id = 1;"),
+    ('timetable version', "SELECT version FROM timetable_versions WHERE batch_id = 1;"),
+    ('admin changes since', "SELECT row_key FROM admin_changes WHERE txid >= 1000;"),
+    ('admin changes to prune', "DELETE FROM admin_changes WHERE changed_at < now() - interval '7 days';"),
+    ('snapshot batches', "SELECT batch_id, slots FROM timetable_snapshot_batches WHERE snapshot_id = 1;"),
+    ('job status', "SELECT state, placed, total FROM scheduler_jobs WHERE job_id = 'x';"),
+    ('active job of a key', "SELECT job_id FROM scheduler_jobs WHERE key = 'global' AND state IN ('queued', 'running');"),
+    ('snapshot batch history', """
+        SELECT snapshot_id FROM timetable_snapshot_batches WHERE batch_id = 1 AND snapshot_id <= 10
+        ORDER BY snapshot_id DESC LIMIT 1;
+    """),
+    ('teacher timetable', "SELECT * FROM teacher_timetable_mv WHERE teacher_id = 1 ORDER BY slot;"),
+    ('free teachers for a subject', """
+        SELECT teacher_id, name FROM teacher_free_slots_mv
+        WHERE day_of_week = 'Tuesday' AND period = 4 AND subject_id = 1;
+    """),
+    ('free teachers', "SELECT DISTINCT teacher_id FROM teacher_free_slots_mv WHERE day_of_week = 'Tuesday' AND period = 4;"),
+]
+
+
+def _full_scans(plan, leading_columns):
+    """Tables read in full: Seq Scans, and index scans whose condition does not
+    constrain the index's leading column, which walk the whole index (the
+    planner's fallback when seqscan is disabled)."""
+    found = []
+    node = plan.get('Node Type')
+    if node == 'Seq Scan':
+        found.append(f"Seq Scan on {plan.get('Relation Name')}")
+    elif node in ('Index Scan', 'Index Only Scan', 'Bitmap Index Scan'):
+        leading = leading_columns.get(plan.get('Index Name'))
+        if leading and f"{leading} " not in plan.get('Index Cond', '').replace(')', ' '):
+            found.append(f"{node} over all of {plan.get('Index Name')}")
+    for child in plan.get('Plans', []):
+        found.extend(_full_scans(child, leading_columns))
+    return found
+
+
+def check_plans(conn, queries=HOT_QUERIES):
+    """EXPLAINs each query with sequential scans disabled; returns {name: [full scans]}.
+
+    With enable_seqscan off the planner still scans a whole table (or index)
+    when no usable index exists, so any full scan left in a plan is a missing
+    index. Running with seqscan off keeps the check meaningful on the small
+    tables of a development database.
+    """
+    failures = {}
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.relname, a.attname FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0];
+        """)
+        leading_columns = dict(cur.fetchall())
+        cur.execute("SET LOCAL enable_seqscan = off;")
+        # Make joins probe the inner side by key, so an inner full scan means a missing index.
+        cur.execute("SET LOCAL enable_hashjoin = off; SET LOCAL enable_mergejoin = off;")
+        for name, sql in queries:
+            cur.execute("EXPLAIN (FORMAT JSON) " + sql)
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            scans = _full_scans(plan[0]['Plan'], leading_columns)
+            if scans:
+                failures[name] = scans
+    conn.rollback()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--status', action='store_true', help="List applied and pending migrations.")
+    parser.add_argument('--check-plans', action='store_true',
+                        help="Fail if any hot query plans a full table scan (migrates first).")
+    args = parser.parse_args()
+
+    with db.connection() as conn:
+        if args.status:
+            with conn.cursor() as cur:
+                done = applied_versions(cur)
+            conn.commit()
+            for version, name, _ in MIGRATIONS:
+                print(f"{version:>4}  {'applied' if version in done else 'pending':<8} {name}")
+            return 0
+
+        applied, cleaned = migrate(conn, allow_cleanups=True)
+        for version, counts in cleaned.items():
+            for what, count in counts.items():
+                print(f"Migration {version}: deleted {count} {what}.")
+        print(f"Applied migrations: {applied}" if applied else "Schema is up to date.")
+        if args.check_plans:
+            failures = check_plans(conn)
+            for name, _ in HOT_QUERIES:
+                status = f"FULL SCAN: {', '.join(failures[name])}" if name in failures else "ok"
+                print(f"  {name:<36} {status}")
+            if failures:
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
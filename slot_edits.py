@@ -0,0 +1,161 @@
+"""Transactional batch edits of timetable slots with in-memory conflict checks.
+
+An edit names one cell, {'batch_id', 'day', 'period'}, and either the
+'subject_id' and 'teacher_id' to put there or neither, which clears it.
+All edits of a request are validated together against an occupancy index of
+the edited batches and the teachers involved, built from one locked read
+(the index holds the timetable as it will be once every edit is applied, so
+swaps and moves within one request are fine). If any edit is invalid nothing
+is written and every conflict is reported; otherwise the edited cells are
+cleared with one bulk DELETE and refilled with one bulk INSERT, so a swap
+never trips the unique slot indexes halfway through.
+"""
+import psycopg2.extras
+
+import cache
+import scheduler
+import snapshots
+from engine import DAYS, LUNCH_BREAK_PERIOD, PERIODS_PER_DAY
+
+
+class SlotEditConflicts(Exception):
+    """Raised with the list of conflicts when a set of slot edits is rejected."""
+
+    def __init__(self, conflicts):
+        super().__init__(f"{len(conflicts)} slot edit(s) conflict")
+        self.conflicts = conflicts
+
+
+def _conflict(conflicts, index, edit, kind, message):
+    conflicts.append({'index': index, 'batch_id': edit.get('batch_id'), 'day': edit.get('day'),
+                      'period': edit.get('period'), 'type': kind, 'message': message})
+
+
+def _parse(edits):
+    """Normalizes the edits; returns (edits, conflicts) for ones that are malformed or repeat a cell."""
+    parsed, conflicts, seen = [], [], {}
+    for index, raw in enumerate(edits):
+        if not isinstance(raw, dict):
+            _conflict(conflicts, index, {}, 'invalid', "Each edit must be an object.")
+            continue
+        try:
+            edit = {'batch_id': int(raw['batch_id']), 'day': raw['day'], 'period': int(raw['period'])}
+            clear = raw.get('subject_id') in (None, '') and raw.get('teacher_id') in (None, '')
+            edit['subject_id'] = None if clear else int(raw['subject_id'])
+            edit['teacher_id'] = None if clear else int(raw['teacher_id'])
+        except (KeyError, TypeError, ValueError):
+            _conflict(conflicts, index, raw, 'invalid',
+                      "An edit needs batch_id, day and period, and either both subject_id and teacher_id or neither.")
+            continue
+        if edit['day'] not in DAYS or not 1 <= edit['period'] <= PERIODS_PER_DAY:
+            _conflict(conflicts, index, edit, 'invalid_slot', f"{edit['day']} period {edit['period']} is not a timetable slot.")
+            continue
+        if edit['period'] == LUNCH_BREAK_PERIOD and edit['teacher_id'] is not None:
+            _conflict(conflicts, index, edit, 'invalid_slot', f"Period {LUNCH_BREAK_PERIOD} is the lunch break.")
+            continue
+        cell = (edit['batch_id'], edit['day'], edit['period'])
+        if cell in seen:
+            _conflict(conflicts, index, edit, 'duplicate_edit', f"The same slot is already edited by edit {seen[cell]}.")
+            continue
+        seen[cell] = index
+        parsed.append((index, edit))
+    return parsed, conflicts
+
+
+def _validate(cur, parsed):
+    """Checks ids, qualifications, teacher clashes and weekly limits against the edited timetable."""
+    conflicts = []
+    batch_ids = sorted({edit['batch_id'] for _, edit in parsed})
+    teacher_ids = sorted({edit['teacher_id'] for _, edit in parsed if edit['teacher_id'] is not None})
+    subject_ids = sorted({edit['subject_id'] for _, edit in parsed if edit['subject_id'] is not None})
+
+    cur.execute("SELECT batch_id FROM batches WHERE batch_id = ANY(%s);", (batch_ids,))
+    known_batches = {row[0] for row in cur.fetchall()}
+    cur.execute("SELECT subject_id FROM subjects WHERE subject_id = ANY(%s);", (subject_ids,))
+    known_subjects = {row[0] for row in cur.fetchall()}
+    cur.execute("SELECT teacher_id, name, max_classes_per_week FROM teachers WHERE teacher_id = ANY(%s);", (teacher_ids,))
+    teachers = {teacher_id: (name, cap) for teacher_id, name, cap in cur.fetchall()}
+    cur.execute("SELECT teacher_id, subject_id FROM teacher_subjects WHERE teacher_id = ANY(%s);", (teacher_ids,))
+    qualified = set(cur.fetchall())
+    # Every row the edits can collide with, locked until commit.
+    cur.execute("""
+        SELECT batch_id, day_of_week, period, subject_id, teacher_id FROM timetable
+        WHERE batch_id = ANY(%s) OR teacher_id = ANY(%s)
+        FOR UPDATE;
+    """, (batch_ids, teacher_ids))
+    cells = {(b_id, day, period): (s_id, t_id) for b_id, day, period, s_id, t_id in cur.fetchall()}
+
+    for index, edit in parsed:
+        cell = (edit['batch_id'], edit['day'], edit['period'])
+        if edit['batch_id'] not in known_batches:
+            _conflict(conflicts, index, edit, 'unknown', f"Batch {edit['batch_id']} does not exist.")
+        elif edit['teacher_id'] is None:
+            cells.pop(cell, None)
+        elif edit['teacher_id'] not in teachers:
+            _conflict(conflicts, index, edit, 'unknown', f"Teacher {edit['teacher_id']} does not exist.")
+        elif edit['subject_id'] not in known_subjects:
+            _conflict(conflicts, index, edit, 'unknown', f"Subject {edit['subject_id']} does not exist.")
+        else:
+            if (edit['teacher_id'], edit['subject_id']) not in qualified:
+                _conflict(conflicts, index, edit, 'unqualified',
+                          f"{teachers[edit['teacher_id']][0]} is not qualified to teach subject {edit['subject_id']}.")
+            cells[cell] = (edit['subject_id'], edit['teacher_id'])
+
+    batches_at = {}
+    load = {}
+    for (b_id, day, period), (_, t_id) in cells.items():
+        batches_at.setdefault((t_id, day, period), []).append(b_id)
+        load[t_id] = load.get(t_id, 0) + 1
+    over_limit = set()
+    for index, edit in parsed:
+        t_id = edit['teacher_id']
+        # Skips clears and edits already rejected above, whose cell keeps its old contents.
+        if cells.get((edit['batch_id'], edit['day'], edit['period'])) != (edit['subject_id'], t_id):
+            continue
+        others = [b_id for b_id in batches_at[(t_id, edit['day'], edit['period'])] if b_id != edit['batch_id']]
+        if others:
+            _conflict(conflicts, index, edit, 'teacher_clash',
+                      f"{teachers[t_id][0]} would also be teaching batch {others[0]} on {edit['day']} period {edit['period']}.")
+        cap = teachers[t_id][1]
+        if cap and load[t_id] > cap and t_id not in over_limit:
+            over_limit.add(t_id)
+            _conflict(conflicts, index, edit, 'teacher_limit',
+                      f"{teachers[t_id][0]} would teach {load[t_id]} classes a week, above their limit of {cap}.")
+    return conflicts
+
+
+def apply_slot_edits(conn, edits, description=None):
+    """Validates `edits` and applies all of them in the caller's transaction; the caller commits.
+
+    Raises SlotEditConflicts, without writing anything, if any edit is
+    invalid. Otherwise returns {'applied', 'cleared', 'snapshot_id'}.
+    """
+    parsed, conflicts = _parse(edits)
+    if not parsed and not conflicts:
+        return {'applied': 0, 'cleared': 0, 'snapshot_id': None}
+    with conn.cursor() as cur:
+        # Waits for a running global regeneration instead of racing its TRUNCATE.
+        cur.execute("SELECT pg_advisory_xact_lock_shared(%s);", (scheduler.SCHEDULER_LOCK_KEY,))
+        # The well-formed edits are checked too, so one response lists every conflict.
+        conflicts = sorted(conflicts + (_validate(cur, parsed) if parsed else []), key=lambda c: c['index'])
+        if conflicts:
+            raise SlotEditConflicts(conflicts)
+
+        edited = [edit for _, edit in parsed]
+        cur.execute("""
+            DELETE FROM timetable t
+            USING unnest(%s::int[], %s::text[], %s::int[]) AS e(batch_id, day_of_week, period)
+            WHERE t.batch_id = e.batch_id AND t.day_of_week = e.day_of_week AND t.period = e.period;
+        """, ([edit['batch_id'] for edit in edited], [edit['day'] for edit in edited],
+              [edit['period'] for edit in edited]))
+        filled = [(edit['batch_id'], edit['subject_id'], edit['teacher_id'], edit['day'], edit['period'])
+                  for edit in edited if edit['teacher_id'] is not None]
+        if filled:
+            psycopg2.extras.execute_values(
+                cur, f"INSERT INTO timetable ({', '.join(scheduler.TIMETABLE_COLUMNS)}) VALUES %s", filled,
+                page_size=len(filled)
+            )
+        cache.bump_batches(cur, [edit['batch_id'] for edit in edited])
+        snapshot_id = snapshots.take_snapshot(cur, 'slot_edit', description or f"{len(edited)} slot edit(s)",
+                                              batch_ids=[edit['batch_id'] for edit in edited])
+    return {'applied': len(filled), 'cleared': len(edited) - len(filled), 'snapshot_id': snapshot_id}
@@ -0,0 +1,230 @@
+"""Immutable timetable snapshots with set-based restore and SQL-side diffs.
+
+A snapshot stores each batch's timetable as one packed BIGINT[] row in
+`timetable_snapshot_batches` (migration 5). Every element is one class:
+
+    teacher_id << 32 | subject_id << 8 | slot
+
+where slot is engine's slot index (day index * PERIODS_PER_DAY + period - 1).
+Packing, unpacking, restoring and diffing all happen in SQL, so neither a
+restore nor a diff pulls the timetables into Python. Diffs only unpack the
+batches whose arrays differ.
+
+Scheduler runs and slot edits take a snapshot in the same transaction as the
+change. Global runs and restores store every batch (a full snapshot). Edits
+that touch a few batches store only those, as a delta on the newest
+snapshot: the batches it leaves out are as in its parent. A delta's
+timetable is resolved from its chain, which starts at its base (the full
+snapshot it builds on). After SNAPSHOT_FULL_EVERY deltas the next snapshot
+is full again, which bounds how long a chain gets. The newest
+SNAPSHOT_RETENTION snapshots are kept, along with the bases they need.
+"""
+import os
+
+import cache
+from engine import DAYS, PERIODS_PER_DAY
+
+# --- CONFIGURATION ---
+SNAPSHOT_RETENTION = int(os.environ.get('TIMETABLE_SNAPSHOT_RETENTION', 200))
+SNAPSHOT_FULL_EVERY = int(os.environ.get('TIMETABLE_SNAPSHOT_FULL_EVERY', 50))
+
+
+
+class SnapshotNotFound(LookupError):
+    """Raised when the snapshot to restore does not exist (or retention just removed it)."""
+
+
+_SLOT_SQL = "((array_position(%(days)s::text[], {t}.day_of_week) - 1) * %(periods)s + {t}.period - 1)"
+
+_PACKED_TEMPLATE = """
+    SELECT t.batch_id,
+           array_agg((t.teacher_id::bigint << 32) | (t.subject_id::bigint << 8) | {slot} ORDER BY {slot}) AS slots
+    FROM timetable t
+    WHERE array_position(%(days)s::text[], t.day_of_week) IS NOT NULL{filter}
+    GROUP BY t.batch_id
+"""
+_PACKED_SQL, _PACKED_BATCHES_SQL = (
+    _PACKED_TEMPLATE.format(slot=_SLOT_SQL.format(t='t'), filter=where)
+    for where in ('', " AND t.batch_id = ANY(%(batch_ids)s::int[])")
+)
+
+# Every batch of snapshot `{id}` as (batch_id, slots): each batch from the
+# newest snapshot of its chain, up to `{id}`, that stores it.
+_RESOLVED_SQL = """
+    SELECT DISTINCT ON (sb.batch_id) sb.batch_id, sb.slots
+    FROM timetable_snapshot_batches sb
+    JOIN timetable_snapshots s ON s.snapshot_id = sb.snapshot_id
+    WHERE coalesce(s.base_id, s.snapshot_id) =
+              (SELECT coalesce(base_id, snapshot_id) FROM timetable_snapshots WHERE snapshot_id = {id})
+      AND sb.snapshot_id <= {id}
+    ORDER BY sb.batch_id, sb.snapshot_id DESC
+"""
+
+# Rows of snapshot `{source}` as (batch_id, slot, subject_id, teacher_id).
+_UNPACKED_SQL = """
+    SELECT s.batch_id, (v & 255)::int AS slot, ((v >> 8) & 16777215)::int AS subject_id, (v >> 32)::int AS teacher_id
+    FROM {source} s, unnest(s.slots) AS v
+"""
+
+
+def take_snapshot(cur, kind, description='', batch_ids=None):
+    """Records the current timetable as a new snapshot; returns its id.
+
+    With `batch_ids`, only those batches are stored, as a delta on the
+    newest snapshot (unless the chain is due a full snapshot, or there is
+    none yet). The caller must have snapshotted every other change to the
+    timetable, as all writers here do.
+    """
+    params = {'days': DAYS, 'periods': PERIODS_PER_DAY, 'kind': kind, 'description': description}
+    parent = None
+    if batch_ids is not None:
+        cur.execute("""
+            SELECT snapshot_id, coalesce(base_id, snapshot_id), depth, batch_count, class_count
+            FROM timetable_snapshots ORDER BY snapshot_id DESC LIMIT 1;
+        """)
+        parent = cur.fetchone()
+        if parent is not None and parent[2] + 1 >= SNAPSHOT_FULL_EVERY:
+            parent = None
+    if parent is None:
+        snapshot_id = _take_full(cur, params)
+    else:
+        snapshot_id = _take_delta(cur, params, parent, sorted(set(batch_ids)))
+    # Keeps the newest SNAPSHOT_RETENTION and everything from the base of the oldest of them on.
+    cur.execute("""
+        DELETE FROM timetable_snapshots WHERE snapshot_id < (
+            SELECT coalesce(base_id, snapshot_id) FROM timetable_snapshots
+            ORDER BY snapshot_id DESC OFFSET %s LIMIT 1
+        );
+    """, (SNAPSHOT_RETENTION - 1,))
+    return snapshot_id
+
+
+def _take_full(cur, params):
+    cur.execute("""
+        INSERT INTO timetable_snapshots (kind, description) VALUES (%(kind)s, %(description)s)
+        RETURNING snapshot_id;
+    """, params)
+    snapshot_id = cur.fetchone()[0]
+    params['snapshot_id'] = snapshot_id
+    cur.execute(f"""
+        WITH packed AS ({_PACKED_SQL}),
+        stored AS (
+            INSERT INTO timetable_snapshot_batches (snapshot_id, batch_id, slots)
+            SELECT %(snapshot_id)s, batch_id, slots FROM packed
+            RETURNING cardinality(slots) AS classes
+        )
+        UPDATE timetable_snapshots
+        SET batch_count = (SELECT count(*) FROM stored), class_count = (SELECT coalesce(sum(classes), 0) FROM stored)
+        WHERE snapshot_id = %(snapshot_id)s;
+    """, params)
+    return snapshot_id
+
+
+def _take_delta(cur, params, parent, batch_ids):
+    """Stores `batch_ids` (an emptied batch as an empty array) on top of `parent`."""
+    parent_id, base_id, depth, batch_count, class_count = parent
+    params.update(parent_id=parent_id, base_id=base_id, depth=depth + 1, batch_ids=batch_ids)
+    # The touched batches' class counts in the parent, to carry its totals forward.
+    cur.execute(f"""
+        SELECT batch_id, cardinality(slots) FROM ({_RESOLVED_SQL.format(id='%(parent_id)s')}) r
+        WHERE batch_id = ANY(%(batch_ids)s::int[]);
+    """, params)
+    before = dict(cur.fetchall())
+    cur.execute("""
+        INSERT INTO timetable_snapshots (kind, description, base_id, depth)
+        VALUES (%(kind)s, %(description)s, %(base_id)s, %(depth)s)
+        RETURNING snapshot_id;
+    """, params)
+    snapshot_id = params['snapshot_id'] = cur.fetchone()[0]
+    cur.execute(f"""
+        INSERT INTO timetable_snapshot_batches (snapshot_id, batch_id, slots)
+        SELECT %(snapshot_id)s, b.batch_id, coalesce(p.slots, '{{}}')
+        FROM unnest(%(batch_ids)s::int[]) AS b(batch_id)
+        LEFT JOIN ({_PACKED_BATCHES_SQL}) p ON p.batch_id = b.batch_id
+        RETURNING batch_id, cardinality(slots);
+    """, params)
+    after = dict(cur.fetchall())
+    batch_count += sum(1 for n in after.values() if n) - sum(1 for n in before.values() if n)
+    class_count += sum(after.values()) - sum(before.values())
+    cur.execute("UPDATE timetable_snapshots SET batch_count = %s, class_count = %s WHERE snapshot_id = %s;",
+                (batch_count, class_count, snapshot_id))
+    return snapshot_id
+
+
+def list_snapshots(cur, limit=50):
+    cur.execute("""
+        SELECT snapshot_id, created_at, kind, description, batch_count, class_count
+        FROM timetable_snapshots ORDER BY snapshot_id DESC LIMIT %s;
+    """, (limit,))
+    columns = [col[0] for col in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+def exists(cur, snapshot_id):
+    cur.execute("SELECT 1 FROM timetable_snapshots WHERE snapshot_id = %s;", (snapshot_id,))
+    return cur.fetchone() is not None
+
+
+def restore_snapshot(cur, snapshot_id):
+    """Replaces the whole timetable with snapshot `snapshot_id` in two statements.
+
+    The caller holds the scheduler lock and commits. The restore is itself
+    recorded as a new snapshot, whose id is returned. Raises SnapshotNotFound,
+    before touching the timetable, if the snapshot is gone; FOR SHARE keeps
+    retention from deleting it until the caller commits.
+    """
+    cur.execute("SELECT 1 FROM timetable_snapshots WHERE snapshot_id = %s FOR SHARE;", (snapshot_id,))
+    if cur.fetchone() is None:
+        raise SnapshotNotFound(f"Snapshot {snapshot_id} not found.")
+    cur.execute("TRUNCATE TABLE timetable RESTART IDENTITY;")
+    cur.execute(f"""
+        INSERT INTO timetable (batch_id, subject_id, teacher_id, day_of_week, period)
+        SELECT u.batch_id, u.subject_id, u.teacher_id,
+               (%(days)s::text[])[u.slot / %(periods)s + 1], u.slot %% %(periods)s + 1
+        FROM ({_UNPACKED_SQL.format(source=f"({_RESOLVED_SQL.format(id='%(snapshot_id)s')})")}) u
+        -- Skip classes whose batch, subject or teacher has since been deleted.
+        WHERE EXISTS (SELECT 1 FROM batches b WHERE b.batch_id = u.batch_id)
+          AND EXISTS (SELECT 1 FROM subjects sj WHERE sj.subject_id = u.subject_id)
+          AND EXISTS (SELECT 1 FROM teachers te WHERE te.teacher_id = u.teacher_id);
+    """, {'days': DAYS, 'periods': PERIODS_PER_DAY, 'snapshot_id': snapshot_id})
+    restored = cur.rowcount
+    cache.bump_all(cur)
+    new_id = take_snapshot(cur, 'restore', f"Restored snapshot {snapshot_id}")
+    return new_id, restored
+
+
+def diff(cur, from_id, to_id=None):
+    """Slots that differ between two snapshots; `to_id=None` compares against the live timetable.
+
+    Returns a list of {'batch_id', 'day_of_week', 'period', 'before', 'after'}
+    where before/after are {'subject_id', 'teacher_id'} or None for an empty slot.
+    """
+    params = {'days': DAYS, 'periods': PERIODS_PER_DAY, 'from_id': from_id, 'to_id': to_id}
+    to_sql = _PACKED_SQL if to_id is None else _RESOLVED_SQL.format(id='%(to_id)s')
+    cur.execute(f"""
+        WITH a AS ({_RESOLVED_SQL.format(id='%(from_id)s')}),
+        b AS ({to_sql}),
+        changed AS (
+            SELECT coalesce(a.batch_id, b.batch_id) AS batch_id,
+                   coalesce(a.slots, '{{}}') AS old_slots, coalesce(b.slots, '{{}}') AS new_slots
+            FROM a FULL JOIN b ON a.batch_id = b.batch_id
+            WHERE a.slots IS DISTINCT FROM b.slots
+        ),
+        old AS ({_UNPACKED_SQL.format(source='(SELECT batch_id, old_slots AS slots FROM changed)')}),
+        new AS ({_UNPACKED_SQL.format(source='(SELECT batch_id, new_slots AS slots FROM changed)')})
+        SELECT coalesce(old.batch_id, new.batch_id), coalesce(old.slot, new.slot),
+               old.subject_id, old.teacher_id, new.subject_id, new.teacher_id
+        FROM old FULL JOIN new ON old.batch_id = new.batch_id AND old.slot = new.slot
+        WHERE old.subject_id IS DISTINCT FROM new.subject_id OR old.teacher_id IS DISTINCT FROM new.teacher_id
+        ORDER BY 1, 2;
+    """, params)
+    changes = []
+    for batch_id, slot, old_subject, old_teacher, new_subject, new_teacher in cur.fetchall():
+        changes.append({
+            'batch_id': batch_id,
+            'day_of_week': DAYS[slot // PERIODS_PER_DAY],
+            'period': slot % PERIODS_PER_DAY + 1,
+            'before': {'subject_id': old_subject, 'teacher_id': old_teacher} if old_subject is not None else None,
+            'after': {'subject_id': new_subject, 'teacher_id': new_teacher} if new_subject is not None else None,
+        })
+    return changes
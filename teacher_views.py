@@ -0,0 +1,149 @@
+"""Per-teacher timetables and free-teacher lookups, served from materialized views.
+
+Migration 6 defines two views, each with a unique index that doubles as its
+lookup key, so every query here is a single index range scan:
+
+    teacher_timetable_mv    (teacher_id, slot, batch_id): the classes each teacher teaches
+    teacher_free_slots_mv   (day_of_week, period, subject_id, teacher_id): who is free when
+
+Statement triggers on the tables they read add a row to
+`teacher_views_changes`, which commits with the change. Any rows there mean
+the views are stale. Lookups never refresh in the request: they answer
+from the views as they are, say whether those are stale, and leave the
+refresh to a background thread (`refresh_soon()`), which writers also call
+after they commit. Refreshes are CONCURRENTLY, so readers are never blocked.
+
+The lookups run on the caller's cursor and expect the schema to be migrated
+already (the app does so before every request).
+"""
+import threading
+
+import db
+import migrations
+from engine import DAYS, LUNCH_BREAK_PERIOD, PERIODS_PER_DAY
+from exporter import PERIOD_TIMES
+
+VIEWS = ('teacher_timetable_mv', 'teacher_free_slots_mv')
+# Serializes refreshes across workers.
+VIEWS_LOCK_KEY = 7_304_115
+# A refresh waiting this long for a table lock (e.g. behind a global run's TRUNCATE)
+# gives up; the writer holding it calls refresh_soon() again once it commits.
+REFRESH_LOCK_TIMEOUT = '5s'
+
+
+def refresh(force=False):
+    """Refreshes the views if anything they read changed since the last refresh; returns whether it did."""
+    migrations.ensure_migrated()
+    with db.connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(%s);", (VIEWS_LOCK_KEY,))
+        cur.execute("SET LOCAL lock_timeout = %s;", (REFRESH_LOCK_TIMEOUT,))
+        # Only committed changes are visible here, and the refresh below sees
+        # all of them; rows of transactions still running stay for the next one.
+        cur.execute("DELETE FROM teacher_views_changes;")
+        if not cur.rowcount and not force:
+            conn.rollback()
+            return False
+        for view in VIEWS:
+            cur.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view};")
+        conn.commit()
+    return True
+
+
+# --- BACKGROUND REFRESH ---
+_refresh_lock = threading.Lock()
+_refresher = None
+_refresh_again = False
+
+
+def _refresh_loop():
+    global _refresher, _refresh_again
+    while True:
+        with _refresh_lock:
+            _refresh_again = False
+        try:
+            refresh()
+        except Exception as e:
+            print(f"  - WARNING: Refreshing the teacher views failed: {e}")
+        with _refresh_lock:
+            if not _refresh_again:
+                _refresher = None
+                return
+
+
+def refresh_soon():
+    """Refreshes the views in a background thread; at most one runs per process, and asks
+    made while it runs are folded into one more pass."""
+    global _refresher, _refresh_again
+    with _refresh_lock:
+        if _refresher is not None:
+            _refresh_again = True
+            return
+        _refresher = threading.Thread(target=_refresh_loop, name='teacher-views-refresh', daemon=True)
+        _refresher.start()
+
+
+def _stale(cur):
+    """Whether changes are waiting to be refreshed into the views; starts that refresh if so."""
+    cur.execute("SELECT EXISTS (SELECT 1 FROM teacher_views_changes);")
+    stale = cur.fetchone()[0]
+    if stale:
+        refresh_soon()
+    return stale
+
+
+# --- LOOKUPS ---
+def teacher_timetable(cur, teacher_id):
+    """Returns (classes, stale): every class of one teacher in week order, or None if
+    there is no such teacher, and whether the views lag behind a recent change."""
+    stale = _stale(cur)
+    cur.execute("""
+        SELECT day_of_week, period, batch_id, batch_name, department, subject_id, subject_name, short_code
+        FROM teacher_timetable_mv WHERE teacher_id = %s ORDER BY slot, batch_id;
+    """, (teacher_id,))
+    columns = [col[0] for col in cur.description]
+    classes = [dict(zip(columns, row)) for row in cur.fetchall()]
+    if not classes:
+        cur.execute("SELECT 1 FROM teachers WHERE teacher_id = %s;", (teacher_id,))
+        if cur.fetchone() is None:
+            return None, stale
+    for item in classes:
+        item['time'] = PERIOD_TIMES.get(item['period'])
+    return classes, stale
+
+
+def check_slot(day, period):
+    """Raises ValueError unless (day, period) is a teaching slot."""
+    if day not in DAYS:
+        raise ValueError(f"day must be one of {', '.join(DAYS)}")
+    if not 1 <= period <= PERIODS_PER_DAY or period == LUNCH_BREAK_PERIOD:
+        raise ValueError(f"period must be a teaching period between 1 and {PERIODS_PER_DAY}, not the lunch break")
+
+
+def free_teachers(cur, day, period, subject_id=None, include_full=False):
+    """Returns (teachers, stale): teachers with no class at (day, period), optionally
+    only those qualified for `subject_id`, and whether the views lag behind.
+
+    Least-loaded teachers come first. Teachers already at their weekly limit
+    are left out unless `include_full`.
+    """
+    check_slot(day, period)
+    stale = _stale(cur)
+    if subject_id is None:
+        cur.execute("""
+            SELECT DISTINCT ON (teacher_id) teacher_id, name, weekly_load, max_classes_per_week
+            FROM teacher_free_slots_mv WHERE day_of_week = %s AND period = %s
+            ORDER BY teacher_id;
+        """, (day, period))
+    else:
+        cur.execute("""
+            SELECT teacher_id, name, weekly_load, max_classes_per_week
+            FROM teacher_free_slots_mv WHERE day_of_week = %s AND period = %s AND subject_id = %s;
+        """, (day, period, subject_id))
+    teachers = []
+    for teacher_id, name, load, cap in cur.fetchall():
+        has_room = not cap or load < cap
+        if has_room or include_full:
+            teachers.append({'teacher_id': teacher_id, 'name': name, 'weekly_load': load,
+                             'max_classes_per_week': cap, 'has_room': has_room})
+    teachers.sort(key=lambda teacher: (teacher['weekly_load'], teacher['teacher_id']))
+    return teachers, stale
@@ -0,0 +1,86 @@
+"""Invariants of the scheduling engine on synthetic institutions.
+
+Runs are made with time_budget=None so that a slow machine cannot cut a
+search short and make two runs with the same seed differ.
+"""
+import random
+from collections import Counter
+
+import pytest
+
+import engine
+from benchmarks import synthetic
+
+
+def _institution(num_batches, scarcity):
+    return synthetic.generate_institution(num_batches, scarcity, seed=3)
+
+
+def _check(problem, result):
+    """Asserts every hard constraint, and that each demanded class was placed or reported failed."""
+    qualified = {(link['teacher_id'], link['subject_id']) for link in problem['teacher_subjects']}
+    teacher_cap = {t['teacher_id']: t.get('max_classes_per_week') for t in problem['teachers']}
+    subject_cap = {s['subject_id']: s.get('max_per_day') for s in problem['subjects']}
+    placements = result['placements']
+
+    for batch_id, subject_id, teacher_id, day, period in placements:
+        assert (teacher_id, subject_id) in qualified
+        assert day in engine.DAYS
+        assert 1 <= period <= engine.PERIODS_PER_DAY and period != engine.LUNCH_BREAK_PERIOD
+
+    teacher_slots = Counter((teacher_id, day, period) for _, _, teacher_id, day, period in placements)
+    batch_slots = Counter((batch_id, day, period) for batch_id, _, _, day, period in placements)
+    assert max(teacher_slots.values(), default=1) == 1, "a teacher is double-booked"
+    assert max(batch_slots.values(), default=1) == 1, "a batch is double-booked"
+
+    for teacher_id, load in Counter(p[2] for p in placements).items():
+        assert not teacher_cap[teacher_id] or load <= teacher_cap[teacher_id]
+    for (_, subject_id, _), count in Counter((p[0], p[1], p[3]) for p in placements).items():
+        assert not subject_cap[subject_id] or count <= subject_cap[subject_id]
+
+    demanded = Counter()
+    for item in problem['batch_subjects']:
+        demanded[(item['batch_id'], item['subject_id'])] += item['classes_per_week']
+    covered = Counter((p[0], p[1]) for p in placements)
+    covered.update((f['batch_id'], f['subject_id']) for f in result['failures'])
+    assert covered == demanded
+    assert result['placed'] == len(placements)
+    assert result['placed'] + len(result['failures']) == result['total'] == synthetic.class_count(problem)
+
+
+@pytest.mark.parametrize('scarcity', sorted(synthetic.SCARCITY_LEVELS))
+@pytest.mark.parametrize('mode', engine.MODES)
+def test_schedule_keeps_constraints(mode, scarcity):
+    problem = _institution(20, scarcity)
+    result = engine.schedule(problem, synthetic.batch_ids(problem), mode=mode, time_budget=None)
+    _check(problem, result)
+
+
+@pytest.mark.parametrize('mode', engine.MODES)
+def test_schedule_is_reproducible(mode):
+    problem = _institution(20, 'tight')
+    batch_ids = synthetic.batch_ids(problem)
+    runs = [engine.schedule(problem, batch_ids, mode=mode, rng=random.Random(7), time_budget=None)
+            for _ in range(2)]
+    assert runs[0]['placements'] == runs[1]['placements']
+
+
+def test_schedule_best_keeps_constraints_and_reproduces_winner():
+    problem = _institution(20, 'scarce')
+    batch_ids = synthetic.batch_ids(problem)
+    best = engine.schedule_best(problem, batch_ids, 3, mode='random', seed=11, time_budget=None, workers=2)
+    _check(problem, best)
+    assert [attempt['seed'] for attempt in best['attempts']] == [11, 12, 13]
+    assert best['score'] == min((attempt['score'] for attempt in best['attempts']), key=lambda s: s['total'])
+
+    again = engine.schedule_best(problem, batch_ids, 1, mode='random', seed=best['seed'], time_budget=None)
+    assert again['placements'] == best['placements']
+
+
+def test_schedule_partitioned_keeps_constraints_and_is_reproducible():
+    problem = _institution(30, 'tight')
+    batch_ids = synthetic.batch_ids(problem)
+    runs = [engine.schedule_partitioned(problem, batch_ids, seed=5, time_budget=None, workers=2) for _ in range(2)]
+    assert runs[0]['groups'] > 1
+    _check(problem, runs[0])
+    assert sorted(runs[0]['placements']) == sorted(runs[1]['placements'])
@@ -0,0 +1,20 @@
+"""The hot queries must not plan a full table scan on a migrated database.
+
+Needs a PostgreSQL database in DATABASE_URL, which it migrates; skipped
+without one.
+"""
+import os
+
+import pytest
+
+pytestmark = pytest.mark.skipif(not os.environ.get('DATABASE_URL'), reason="DATABASE_URL is not set")
+
+
+def test_hot_queries_use_indexes():
+    import db
+    import migrations
+
+    migrations.ensure_migrated()
+    with db.connection() as conn:
+        failures = migrations.check_plans(conn)
+    assert failures == {}, "full scans: " + "; ".join(f"{name}: {', '.join(scans)}" for name, scans in failures.items())
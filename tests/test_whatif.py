@@ -0,0 +1,100 @@
+"""The what-if preview must delete the same rows as the real repair.
+
+whatif._invalid_rows is a Python copy of scheduler._DELETE_INVALID_ROWS. This
+runs both over the same edited synthetic institutions and compares the rows
+they delete. The SQL runs against temporary tables that shadow the real ones
+in a rolled-back transaction, so it needs a PostgreSQL database in
+DATABASE_URL (nothing in it is changed) and is skipped without one.
+"""
+import copy
+import os
+
+import pytest
+
+import engine
+import scheduler
+import whatif
+from benchmarks import synthetic
+
+pytestmark = pytest.mark.skipif(not os.environ.get('DATABASE_URL'), reason="DATABASE_URL is not set")
+
+_TABLES = {
+    'teachers': ['teacher_id', 'max_classes_per_week'],
+    'teacher_subjects': ['teacher_id', 'subject_id'],
+    'batch_subjects': ['batch_id', 'subject_id', 'classes_per_week'],
+}
+
+
+@pytest.fixture(scope='module')
+def live():
+    """A scheduled synthetic institution, with its rows as whatif.load_live returns them."""
+    problem = synthetic.generate_institution(30, 'tight', seed=5)
+    result = engine.schedule(problem, synthetic.batch_ids(problem), time_budget=None)
+    problem['commitments'] = [
+        {'batch_id': b_id, 'subject_id': s_id, 'teacher_id': t_id, 'day_of_week': day, 'period': period}
+        for b_id, s_id, t_id, day, period in result['placements']
+    ]
+    return problem
+
+
+def _busiest_teacher(problem):
+    loads = {}
+    for row in problem['commitments']:
+        loads[row['teacher_id']] = loads.get(row['teacher_id'], 0) + 1
+    return max(loads, key=lambda teacher_id: (loads[teacher_id], teacher_id))
+
+
+def _scenarios(problem):
+    teacher_id = _busiest_teacher(problem)
+    subjects = [link['subject_id'] for link in problem['teacher_subjects'] if link['teacher_id'] == teacher_id]
+    row = problem['commitments'][0]
+    batch_rows = [item for item in problem['batch_subjects'] if item['batch_id'] == row['batch_id']]
+    return {
+        'teacher cap lowered': ([{'op': 'update_teacher', 'teacher_id': teacher_id, 'max_classes': 3}], ()),
+        'teacher subject dropped': ([{'op': 'update_teacher', 'teacher_id': teacher_id, 'subjects': subjects[1:]}], ()),
+        'batch classes cut': ([{'op': 'update_batch', 'batch_id': row['batch_id'], 'subjects': [
+            {'id': item['subject_id'], 'classes': 1} for item in batch_rows[1:]]}], ()),
+        'subject dropped from batch': ([{'op': 'set_classes', 'batch_id': row['batch_id'],
+                                         'subject_id': row['subject_id'], 'classes': 0}], ()),
+        'whole subject in scope': ([{'op': 'update_teacher', 'teacher_id': teacher_id, 'max_classes': 2}],
+                                   (row['subject_id'],)),
+    }
+
+
+def _sql_deleted(cur, problem, scope):
+    for table, columns in _TABLES.items():
+        cur.execute(f"CREATE TEMP TABLE {table} ON COMMIT DROP AS SELECT {', '.join(columns)} "
+                    f"FROM public.{table} WHERE false;")
+        for item in problem[table]:
+            cur.execute(f"INSERT INTO {table} VALUES ({', '.join(['%s'] * len(columns))});",
+                        [item.get(column) for column in columns])
+    cur.execute("CREATE TEMP TABLE timetable ON COMMIT DROP AS SELECT timetable_id, batch_id, subject_id, "
+                "teacher_id, day_of_week, period FROM public.timetable WHERE false;")
+    for index, row in enumerate(problem['commitments']):
+        cur.execute("INSERT INTO timetable VALUES (%s, %s, %s, %s, %s, %s);",
+                    (index, row['batch_id'], row['subject_id'], row['teacher_id'], row['day_of_week'], row['period']))
+    cur.execute("SELECT timetable_id FROM timetable;")
+    before = {r[0] for r in cur.fetchall()}
+    cur.execute(scheduler._DELETE_INVALID_ROWS, scope)
+    cur.execute("SELECT timetable_id FROM timetable;")
+    return before - {r[0] for r in cur.fetchall()}
+
+
+def test_preview_deletes_the_rows_the_repair_deletes(live):
+    import db
+
+    deleted_any = False
+    for name, (edits, subject_ids) in _scenarios(live).items():
+        problem = copy.deepcopy(live)
+        scope = whatif.apply_edits(problem, edits)
+        scope['subject_ids'].update(subject_ids)
+        expected = whatif._invalid_rows(problem, scope['batch_ids'], scope['subject_ids'], scope['teacher_ids'])
+        with db.connection() as conn, conn.cursor() as cur:
+            try:
+                deleted = _sql_deleted(cur, problem, {key: sorted(scope[key])
+                                                      for key in ('batch_ids', 'subject_ids', 'teacher_ids')})
+            finally:
+                conn.rollback()
+        assert deleted == expected, name
+        deleted_any = deleted_any or bool(deleted)
+    assert deleted_any
@@ -0,0 +1,279 @@
+"""What-if scheduling: previews the timetable an edit would produce, without writing anything.
+
+The current data is read once, in a read-only REPEATABLE READ transaction
+(plain SELECTs, so no locks beyond what any reader takes). Hypothetical edits
+are then applied to the in-memory problem and the engine runs entirely in
+RAM. Edits are a list of operations shaped like the admin routes' payloads:
+
+    {'op': 'add_teacher', 'name', 'max_classes', 'subjects': [subject_id, ...]}
+    {'op': 'update_teacher', 'teacher_id', ['max_classes'], ['subjects']}
+    {'op': 'delete_teacher', 'teacher_id'}
+    {'op': 'update_subject', 'subject_id', ['max_day']}
+    {'op': 'update_batch', 'batch_id', 'subjects': [{'id', 'classes'}, ...]}
+    {'op': 'set_classes', 'batch_id', 'subject_id', 'classes'}  # 0 drops the subject
+
+With the 'repair' strategy the preview is what saving those edits would do
+(see scheduler.repair_timetable); with 'regenerate' it is a fresh run over
+`batch_ids` (default: every batch) around the rest of the live timetable.
+"""
+import os
+import time
+
+import psycopg2.extras
+
+import engine
+import scheduler
+from engine import DAYS, PERIODS_PER_DAY, SLOT_INDEX
+
+# --- CONFIGURATION ---
+# Seconds of search backtracking a preview may use, and the most a request may ask for.
+WHATIF_TIME_BUDGET = float(os.environ.get('WHATIF_TIME_BUDGET', 2.0))
+WHATIF_MAX_TIME_BUDGET = float(os.environ.get('WHATIF_MAX_TIME_BUDGET', 10.0))
+STRATEGIES = ('repair', 'regenerate')
+
+
+class WhatIfError(ValueError):
+    """Raised for an edit or option the preview cannot apply."""
+
+
+# Oldest timetable rows first, the order repair_timetable keeps them in.
+_LOAD_SQL = {
+    'subjects': "SELECT * FROM subjects;",
+    'teachers': "SELECT * FROM teachers;",
+    'teacher_subjects': "SELECT teacher_id, subject_id FROM teacher_subjects;",
+    'batches': "SELECT batch_id, department FROM batches;",
+    'batch_subjects': "SELECT * FROM batch_subjects;",
+    'commitments': "SELECT batch_id, subject_id, teacher_id, day_of_week, period FROM timetable ORDER BY timetable_id;",
+}
+
+
+def load_live(conn):
+    """Reads the scheduling data and the live timetable in one read-only snapshot."""
+    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY;")
+        problem = {}
+        for key, sql in _LOAD_SQL.items():
+            cur.execute(sql)
+            problem[key] = [dict(row) for row in cur.fetchall()]
+    conn.rollback()
+    return problem
+
+
+# --- EDITS ---
+def _find(rows, key, value, what):
+    for row in rows:
+        if row[key] == value:
+            return row
+    raise WhatIfError(f"Unknown {what} {value}")
+
+
+def _int(edit, field):
+    try:
+        return int(edit[field])
+    except KeyError:
+        raise WhatIfError(f"'{edit.get('op')}' needs '{field}'")
+    except (TypeError, ValueError):
+        raise WhatIfError(f"'{field}' must be an integer")
+
+
+def apply_edits(problem, edits):
+    """Applies `edits` to `problem` in place; returns the repair scope.
+
+    The scope is a dict of the scheduler.repair_timetable arguments the
+    matching admin routes would pass: 'batch_ids', 'subject_ids' and
+    'teacher_ids' sets, the 'vacated' (batch_id, subject_id) rows of deleted
+    teachers, and the classes 'added' per (batch_id, subject_id).
+    """
+    scope = {'batch_ids': set(), 'subject_ids': set(), 'teacher_ids': set(), 'vacated': [], 'added': {}}
+    next_teacher_id = -1
+    for edit in edits:
+        if not isinstance(edit, dict):
+            raise WhatIfError("Each edit must be an object with an 'op'")
+        op = edit.get('op')
+        if op == 'add_teacher' or op == 'update_teacher':
+            if op == 'add_teacher':
+                teacher_id, next_teacher_id = next_teacher_id, next_teacher_id - 1
+                teacher = {'teacher_id': teacher_id, 'name': edit.get('name') or f"New teacher {-teacher_id}"}
+                problem['teachers'].append(teacher)
+            else:
+                teacher_id = _int(edit, 'teacher_id')
+                teacher = _find(problem['teachers'], 'teacher_id', teacher_id, 'teacher')
+            if 'max_classes' in edit or op == 'add_teacher':
+                cap = int(edit.get('max_classes') or 0)
+                if op == 'update_teacher' and cap != (teacher.get('max_classes_per_week') or 0):
+                    scope['teacher_ids'].add(teacher_id)
+                teacher['max_classes_per_week'] = cap
+            if 'subjects' in edit or op == 'add_teacher':
+                new_subjects = {int(s_id) for s_id in edit.get('subjects') or ()}
+                for s_id in new_subjects:
+                    _find(problem['subjects'], 'subject_id', s_id, 'subject')
+                links = problem['teacher_subjects']
+                if {link['subject_id'] for link in links if link['teacher_id'] == teacher_id} - new_subjects:
+                    scope['teacher_ids'].add(teacher_id)
+                links[:] = [link for link in links if link['teacher_id'] != teacher_id]
+                links.extend({'teacher_id': teacher_id, 'subject_id': s_id} for s_id in sorted(new_subjects))
+        elif op == 'delete_teacher':
+            teacher_id = _int(edit, 'teacher_id')
+            _find(problem['teachers'], 'teacher_id', teacher_id, 'teacher')
+            problem['teachers'] = [t for t in problem['teachers'] if t['teacher_id'] != teacher_id]
+            scope['vacated'].extend((row['batch_id'], row['subject_id'])
+                                    for row in problem['commitments'] if row['teacher_id'] == teacher_id)
+            problem['teacher_subjects'] = [link for link in problem['teacher_subjects'] if link['teacher_id'] != teacher_id]
+            problem['commitments'] = [row for row in problem['commitments'] if row['teacher_id'] != teacher_id]
+        elif op == 'update_subject':
+            subject = _find(problem['subjects'], 'subject_id', _int(edit, 'subject_id'), 'subject')
+            if 'max_day' in edit:
+                subject['max_per_day'] = int(edit['max_day'] or 0)
+        elif op == 'update_batch' or op == 'set_classes':
+            batch_id = _int(edit, 'batch_id')
+            _find(problem['batches'], 'batch_id', batch_id, 'batch')
+            if op == 'update_batch':
+                try:
+                    wanted = {int(sub['id']): int(sub['classes']) for sub in edit.get('subjects') or ()}
+                except (KeyError, TypeError, ValueError):
+                    raise WhatIfError("'subjects' must be a list of {'id', 'classes'} integers")
+            else:
+                wanted = {_int(edit, 'subject_id'): _int(edit, 'classes')}
+            replaced = wanted if op == 'set_classes' else None
+            old = {row['subject_id']: row['classes_per_week'] for row in problem['batch_subjects']
+                   if row['batch_id'] == batch_id and (replaced is None or row['subject_id'] in replaced)}
+            kept = [row for row in problem['batch_subjects']
+                    if row['batch_id'] != batch_id or (replaced is not None and row['subject_id'] not in replaced)]
+            for s_id, classes in wanted.items():
+                _find(problem['subjects'], 'subject_id', s_id, 'subject')
+                if classes < 0:
+                    raise WhatIfError("classes must not be negative")
+            kept.extend({'batch_id': batch_id, 'subject_id': s_id, 'classes_per_week': classes}
+                        for s_id, classes in wanted.items() if classes)
+            problem['batch_subjects'] = kept
+            if old != {s_id: classes for s_id, classes in wanted.items() if classes}:
+                scope['batch_ids'].add(batch_id)
+                for s_id, classes in wanted.items():
+                    if classes > old.get(s_id, 0):
+                        key = (batch_id, s_id)
+                        scope['added'][key] = scope['added'].get(key, 0) + classes - old.get(s_id, 0)
+        else:
+            raise WhatIfError(f"Unknown edit op {op!r}")
+    return scope
+
+
+# --- PREVIEW ---
+def _invalid_rows(problem, batch_ids, subject_ids, teacher_ids):
+    """Indexes of the live rows scheduler.repair_timetable would delete, oldest rows kept first."""
+    wanted = {(row['batch_id'], row['subject_id']): row['classes_per_week'] for row in problem['batch_subjects']}
+    qualified = {(link['teacher_id'], link['subject_id']) for link in problem['teacher_subjects']}
+    teacher_cap = {t['teacher_id']: t.get('max_classes_per_week') or 0 for t in problem['teachers']}
+    per_subject, per_teacher = {}, {}
+    invalid = set()
+    for i, row in enumerate(problem['commitments']):
+        key = (row['batch_id'], row['subject_id'])
+        per_subject[key] = per_subject.get(key, 0) + 1
+        per_teacher[row['teacher_id']] = per_teacher.get(row['teacher_id'], 0) + 1
+        if (row['batch_id'] not in batch_ids and row['subject_id'] not in subject_ids
+                and row['teacher_id'] not in teacher_ids):
+            continue
+        cap = teacher_cap.get(row['teacher_id'], 0)
+        if (key not in wanted or per_subject[key] > wanted[key]
+                or (row['teacher_id'], row['subject_id']) not in qualified
+                or (cap > 0 and per_teacher[row['teacher_id']] > cap)):
+            invalid.add(i)
+    return invalid
+
+
+def _slot_map(rows):
+    return {(row['batch_id'], SLOT_INDEX[(row['day_of_week'], row['period'])]): (row['subject_id'], row['teacher_id'])
+            for row in rows if (row['day_of_week'], row['period']) in SLOT_INDEX}
+
+
+def diff_rows(before_rows, after_rows):
+    """Changed slots, shaped like snapshots.diff."""
+    before, after = _slot_map(before_rows), _slot_map(after_rows)
+    changes = []
+    for batch_id, slot in sorted(set(before) | set(after)):
+        old, new = before.get((batch_id, slot)), after.get((batch_id, slot))
+        if old == new:
+            continue
+        changes.append({
+            'batch_id': batch_id,
+            'day_of_week': DAYS[slot // PERIODS_PER_DAY],
+            'period': slot % PERIODS_PER_DAY + 1,
+            'before': {'subject_id': old[0], 'teacher_id': old[1]} if old else None,
+            'after': {'subject_id': new[0], 'teacher_id': new[1]} if new else None,
+        })
+    return changes
+
+
+def _coverage(problem, rows):
+    """Scheduled vs required classes over every batch's workload."""
+    required = {(row['batch_id'], row['subject_id']): row['classes_per_week'] for row in problem['batch_subjects']}
+    scheduled = {}
+    for row in rows:
+        key = (row['batch_id'], row['subject_id'])
+        if key in required:
+            scheduled[key] = scheduled.get(key, 0) + 1
+    total = sum(required.values())
+    placed = sum(min(count, required[key]) for key, count in scheduled.items())
+    return {'scheduled': placed, 'required': total, 'rate': round(placed / total, 4) if total else 1.0}
+
+
+def preview(conn, edits=(), strategy='repair', batch_ids=None, time_budget=None, mode=None):
+    """Runs the scheduler over the live data with `edits` applied, entirely in memory.
+
+    Returns the engine's placed/total/failures for the classes it had to
+    place, whole-timetable coverage before and after, and the slot diff
+    against the live timetable. `time_budget` only limits the search's
+    backtracking, less the time loading and applying the edits already
+    took. Loading, the greedy placement and the matching passes never check
+    it, so a preview over a large scope can take longer.
+    """
+    started = time.monotonic()
+    if strategy not in STRATEGIES:
+        raise WhatIfError(f"strategy must be one of {', '.join(STRATEGIES)}")
+    budget = WHATIF_TIME_BUDGET if time_budget is None else float(time_budget)
+    budget = max(0.0, min(budget, WHATIF_MAX_TIME_BUDGET))
+
+    problem = load_live(conn)
+    live_rows = problem['commitments']
+    live_coverage = _coverage(problem, live_rows)
+    scope = apply_edits(problem, list(edits))
+
+    if strategy == 'repair':
+        invalid = _invalid_rows(problem, scope['batch_ids'], scope['subject_ids'], scope['teacher_ids'])
+        kept = [row for i, row in enumerate(problem['commitments']) if i not in invalid]
+        wanted = dict(scope['added'])
+        deleted = [problem['commitments'][i] for i in invalid]
+        for key in [(row['batch_id'], row['subject_id']) for row in deleted] + scope['vacated']:
+            wanted[key] = wanted.get(key, 0) + 1
+        missing = {(row['batch_id'], row['subject_id']): row['classes_per_week'] for row in problem['batch_subjects']}
+        for row in kept:
+            key = (row['batch_id'], row['subject_id'])
+            if key in missing:
+                missing[key] -= 1
+        workload = scheduler.repair_workload(wanted, missing)
+        run_batch_ids = sorted({row['batch_id'] for row in workload})
+    else:
+        known = {row['batch_id'] for row in problem['batches']}
+        run_batch_ids = sorted(known if batch_ids is None else {int(b_id) for b_id in batch_ids})
+        unknown = [b_id for b_id in run_batch_ids if b_id not in known]
+        if unknown:
+            raise WhatIfError(f"Unknown batch {unknown[0]}")
+        regenerated = set(run_batch_ids)
+        kept = [row for row in problem['commitments'] if row['batch_id'] not in regenerated]
+        workload = [row for row in problem['batch_subjects'] if row['batch_id'] in regenerated]
+
+    remaining = max(0.0, budget - (time.monotonic() - started))
+    result = engine.schedule(dict(problem, commitments=kept, batch_subjects=workload), run_batch_ids,
+                             mode=mode or scheduler.SCHEDULER_MODE, time_budget=remaining)
+    after_rows = kept + [{'batch_id': b_id, 'subject_id': s_id, 'teacher_id': t_id, 'day_of_week': day, 'period': period}
+                         for b_id, s_id, t_id, day, period in result['placements']]
+    elapsed = time.monotonic() - started
+    return {
+        'strategy': strategy,
+        'removed': len(live_rows) - len(kept),
+        'placed': result['placed'], 'total': result['total'],
+        'placement_rate': round(result['placed'] / result['total'], 4) if result['total'] else 1.0,
+        'failures': result['failures'],
+        'coverage': {'before': live_coverage, 'after': _coverage(problem, after_rows)},
+        'changes': diff_rows(live_rows, after_rows),
+        'elapsed_ms': round(elapsed * 1000, 1), 'time_budget_ms': round(budget * 1000, 1),
+    }